@@ -0,0 +1,559 @@
+"""
+Performance benchmarks on fixed synthetic inputs.
+
+Usage: python benchmarks.py [benchmark ...] [--json results.json]
+                            [--compare baseline.json] [--tolerance 0.25]
+
+Results are saved as JSON list of records
+{"benchmark": ..., "case": ..., "ms": ...}. With `--compare` the exit code is
+1 if any case is slower than in the baseline by more than `--tolerance`.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from hsv_color_picker import SliderHSV, profiling
+from hsv_color_picker.cv_utils import Align, put_text_block
+from hsv_color_picker.display import (EventTrace, MemoryBackend, MouseEvent,
+                                      replay)
+from hsv_color_picker.histogram import StreamingHistogram
+from hsv_color_picker.masking import (ColorClassifier, FrameMasker,
+                                      HSVRange, IncrementalMasker, RangeMask,
+                                      ROIMasker, SliderMask, TiledMasker,
+                                      suggest_range)
+from hsv_color_picker.multi_selection import MultiRectSelection
+from hsv_color_picker.sources import SyntheticSource
+from hsv_color_picker.selection import (Point, Rect, RectElement, RectSelection,
+                                        Vector)
+
+BENCHMARKS = {}
+RESULTS = []
+IMAGE_SIZES = {'VGA': (480, 640), '1080p': (1080, 1920), '4K': (2160, 3840),
+               '8K': (4320, 7680)}
+RESOLUTIONS = {k: IMAGE_SIZES[k] for k in ('1080p', '4K')}
+WIDGET_SIZES = (256, 512, 1024, 2048)
+_current = None  # name of running benchmark
+
+
+def benchmark(func):
+    "Registers benchmark function"
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def measure(func, min_time: float=0.1, repeat: int=3) -> float:
+    """
+    Returns best time per call in milliseconds. Number of calls per repeat
+    is chosen so that a repeat takes at least `min_time` seconds.
+    """
+    start = time.perf_counter()
+    func()
+    once = time.perf_counter() - start
+    number = max(1, int(min_time / once)) if once else 1000
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1000
+
+
+def peak_bytes(func) -> int:
+    "Returns peak size of memory allocated by a call (temporary objects)"
+    func()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def synthetic_frame(height: int, width: int, seed: int=0) -> np.ndarray:
+    "Random BGR frame, the same for the same arguments"
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3),
+                                                dtype=np.uint8)
+
+
+def report(name: str, ms: float, baseline_ms: float=None, **extra):
+    "Prints and records result of a benchmark case"
+    RESULTS.append({'benchmark': _current, 'case': name, 'ms': ms, **extra})
+    speedup = f" (x{baseline_ms / ms:.2f})" if baseline_ms else ""
+    print(f"{name:<40} {ms:8.3f} ms{speedup}")
+
+
+def headless_slider(size: int) -> SliderHSV:
+    "SliderHSV which doesn't display (nor copy) frames"
+    return SliderHSV('benchmark', size=size, backend=MemoryBackend(max_frames=0))
+
+
+@benchmark
+def slider_init():
+    "`SliderHSV.__init__`: templates, hue strip and the first render"
+    for size in WIDGET_SIZES:
+        report(f"{size}px", measure(lambda: headless_slider(size), repeat=1))
+
+
+@benchmark
+def slider_set_value():
+    "`SliderHSV.set_value` (cached and uncached), `create_sat_br_rect`"
+    for size in WIDGET_SIZES:
+        slider = headless_slider(size)
+        hues = iter(range(10 ** 9))
+
+        def uncached():
+            slider.plane_cache.clear()
+            slider.set_value(next(hues) % 180)
+        report(f"{size}px set_value", measure(uncached))
+        report(f"{size}px set_value (cached)",
+               measure(lambda: slider.set_value(next(hues) % 2)))
+        report(f"{size}px create_sat_br_rect (cached)",
+               measure(lambda: slider.create_sat_br_rect(next(hues) % 2)))
+        tpl = np.empty((size, size, 3), np.uint8)  # template of cvtColor version
+        ramp = np.uint8(np.linspace(0., 255., size))
+        tpl[..., 1], tpl[..., 2] = ramp[:, None], ramp[None]
+
+        def cvt_color():
+            tpl[..., 0] = 10  # between sectors of hue hexagon
+            return cv2.cvtColor(tpl, cv2.COLOR_HSV2BGR)
+        baseline = measure(cvt_color)
+        report(f"{size}px HSV template cvtColor", baseline)
+        report(f"{size}px render_sat_br_plane",
+               measure(lambda: slider.render_sat_br_plane(10)), baseline)
+
+
+@benchmark
+def import_time():
+    "Interpreter start with imports, lazy package vs eager widget import"
+    def start(code):
+        return lambda: subprocess.run([sys.executable, '-c', code], check=True,
+                                      cwd=os.path.dirname(os.path.abspath(__file__)))
+    interpreter = measure(start('pass'), repeat=5)
+    report("interpreter", interpreter)
+    eager = measure(start('from hsv_color_picker import SliderHSV'), repeat=5)
+    report("from hsv_color_picker import SliderHSV", eager)
+    for code in ('import hsv_color_picker',
+                 'from hsv_color_picker import Rect, transformed_rect',
+                 'from hsv_color_picker.geometry import alignment_vector'):
+        report(code, measure(start(code), repeat=5), eager)
+
+
+@benchmark
+def draw_rect():
+    "`RectSelection.draw_rect` with and without area highlight"
+    for label, (height, width) in IMAGE_SIZES.items():
+        img = synthetic_frame(height, width)
+        sel = RectSelection('benchmark', img, (0, 0, width, height),
+                            backend=MemoryBackend(max_frames=0))
+        rects = [Rect(width // 4 + i, height // 4 + i, width // 8, height // 8)
+                 for i in range(2)]
+        for hilight in (None, RectElement.area):
+            i = iter(range(10 ** 9))
+            report(f"{label} hilight={hilight and hilight.name}",
+                   measure(lambda: sel.draw_rect(rects[next(i) % 2], hilight)))
+
+
+@benchmark
+def geometry():
+    "`transformed_rect`, `get_cursor_area` and `pos_in_rect`"
+    sel = RectSelection('benchmark', np.zeros((1, 1, 3), np.uint8),
+                        (0, 0, 1920, 1080), backend=MemoryBackend(max_frames=0))
+    sel.sel_rc = Rect(100, 100, 200, 150)
+    bounds, vec = Rect(0, 0, 1920, 1080), Vector(7, -5)
+    for el in (RectElement.area, RectElement.topright, RectElement.from_center):
+        report(f"transformed_rect {el.name}", measure(
+            lambda: RectSelection.transformed_rect(sel.sel_rc, el, vec, bounds)))
+    report("get_cursor_area (corner)", measure(lambda: sel.get_cursor_area(299, 100)))
+    report("get_cursor_area (outside)", measure(lambda: sel.get_cursor_area(900, 900)))
+    report("pos_in_rect", measure(lambda: sel.pos_in_rect(150, 150, sel.sel_rc)))
+
+    def drag_event():
+        "geometry of a drag event: resize, hit test and corners for drawing"
+        rc = RectSelection.transformed_rect(sel.sel_rc, RectElement.bottomright,
+                                            Point(310, 260) - Point(299, 249),
+                                            bounds)
+        sel.get_cursor_area(310, 260)
+        return rc.points
+    report("drag event", measure(drag_event), peak_bytes=peak_bytes(drag_event))
+
+
+@benchmark
+def text_block():
+    "`put_text_block` with S/B labels as drawn by `SliderHSV.on_sel_update`"
+    img = np.zeros((256, 256, 3), np.uint8)
+    font_params = SliderHSV.font_params
+    report("top-left", measure(lambda: put_text_block(
+        img, "S.50.2%\nB.12.5%", Vector(20, 20), font_params)))
+    report("bottom-right", measure(lambda: put_text_block(
+        img, "S.50.2%\nB.12.5%", Vector(200, 200), font_params,
+        align=Align.bottom | Align.right)))
+
+
+@benchmark
+def wraparound_mask():
+    "Wrapping hue range: demo.py loop (two `inRange`) vs `RangeMask`"
+    rng = HSVRange.from_colors((175, 40, 40), (175, 220, 220), hue_width=10)
+    lower, upper = np.uint8(rng.lower), np.uint8(rng.upper)
+
+    for label, shape in IMAGE_SIZES.items():
+        frame = synthetic_frame(*shape)
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+
+        def two_in_range():
+            mask1 = cv2.inRange(hsv, lower, np.uint8([179, *upper[1:]]))
+            mask2 = cv2.inRange(hsv, np.uint8([0, *lower[1:]]), upper)
+            return mask1 + mask2
+
+        def demo_loop():
+            "conversion, thresholding and masking as in the original demo.py"
+            nonlocal hsv
+            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+            return cv2.bitwise_and(frame, frame, mask=two_in_range())
+
+        mask = RangeMask(rng)
+        dst = np.empty(shape, np.uint8)
+        assert np.array_equal(two_in_range(), mask(hsv, dst))
+        baseline = measure(two_in_range)
+        report(f"{label} two inRange", baseline)
+        report(f"{label} RangeMask", measure(lambda: mask(hsv, dst)), baseline)
+        report(f"{label} demo.py loop", measure(demo_loop))
+
+
+@benchmark
+def tiled_mask_scaling():
+    "`cvtColor` -> `inRange` -> `bitwise_and` on 1-N threads, see `TiledMasker`"
+    rng = HSVRange.from_colors((175, 40, 40), (175, 220, 220), hue_width=10)
+    for label, shape in RESOLUTIONS.items():
+        frame = synthetic_frame(*shape)
+        mask, masked = np.empty(shape, np.uint8), np.empty_like(frame)
+        baseline = None
+        for threads in range(1, (os.cpu_count() or 1) + 1):
+            with TiledMasker(rng, threads=threads, strips=threads * 2) as tiled:
+                ms = measure(lambda: tiled(frame, mask, masked))
+            report(f"{label} {threads} thread(s)", ms, baseline)
+            baseline = baseline or ms
+
+
+@benchmark
+def pooled_mask():
+    "Demo loop iteration (HSV, mask, masked image), allocating vs `FrameMasker`"
+    rng = HSVRange.from_colors((175, 40, 40), (175, 220, 220), 10)
+    lower, upper = np.uint8((0, 40, 40)), np.uint8((5, 220, 220))
+    lower2, upper2 = np.uint8((165, 40, 40)), np.uint8((179, 220, 220))
+
+    def allocating(frame):
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, lower, upper) + cv2.inRange(hsv, lower2, upper2)
+        return cv2.bitwise_and(frame, frame, mask=mask)
+    for label in ('1080p', '4K'):
+        frame = synthetic_frame(*IMAGE_SIZES[label])
+        masker = FrameMasker(rng)
+        baseline = measure(lambda: allocating(frame))
+        report(f"{label} allocating", baseline,
+               peak_bytes=peak_bytes(lambda: allocating(frame)))
+        masker.pool.reset_stats()
+        report(f"{label} FrameMasker", measure(lambda: masker(frame)), baseline,
+               peak_bytes=peak_bytes(lambda: masker(frame)),
+               allocations=masker.pool.allocations)
+
+
+@benchmark
+def incremental_mask():
+    "`IncrementalMasker` of static 4K scene with a moving object vs full mask"
+    height, width = IMAGE_SIZES['4K']
+    scene = synthetic_frame(height, width)
+    rng = HSVRange.from_colors((175, 40, 40), (175, 220, 220), 10)
+    frames = []
+    for i in range(8):  # 200 px object moves by 50 px per frame
+        frame = scene.copy()
+        x = 1000 + 50 * i
+        frame[1000:1200, x:x + 200] = (0, 0, 255)
+        frames.append(frame)
+    mask, hsv = RangeMask(rng), np.empty_like(scene)
+    dst = np.empty((height, width), np.uint8)
+    i = iter(range(10 ** 9))
+    baseline = measure(lambda: mask(cv2.cvtColor(frames[next(i) % 8], cv2.COLOR_BGR2HSV,
+                                                 dst=hsv), dst))
+    report("full mask", baseline)
+    for block in (16, 32, 64):
+        masker = IncrementalMasker(rng, block=block)
+        masker(frames[-1])
+        masker.blocks = masker.skipped = 0  # first frame is masked entirely
+        report(f"block={block}", measure(lambda: masker(frames[next(i) % 8])),
+               baseline, skip_fraction=masker.skip_fraction)
+        print(f"{'':<40} skipped {masker.skip_fraction:.1%}")
+    noise = [synthetic_frame(height, width, seed) for seed in range(2)]
+    masker = IncrementalMasker(rng)
+    report("block=32 every block changed",
+           measure(lambda: masker(noise[next(i) % 2])), baseline,
+           skip_fraction=masker.skip_fraction)
+
+
+@benchmark
+def roi_mask():
+    "`ROIMasker` of centered ROI of 4K frame vs full frame conversion and mask"
+    height, width = IMAGE_SIZES['4K']
+    frame = synthetic_frame(height, width)
+    rng = HSVRange.from_colors((175, 40, 40), (175, 220, 220), 10)
+    mask, hsv = RangeMask(rng), np.empty_like(frame)
+    dst = np.empty((height, width), np.uint8)
+    baseline = measure(lambda: mask(cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=hsv), dst))
+    report("full frame", baseline)
+    for percent in (1, 10, 50):
+        scale = (percent / 100) ** 0.5
+        w, h = int(width * scale), int(height * scale)
+        rc = Rect((width - w) // 2, (height - h) // 2, w, h)
+        for output in ('full', 'roi'):
+            masker = ROIMasker(rng, rc, output=output)
+            out = dst if output == 'full' else None
+            report(f"{percent}% area output={output}",
+                   measure(lambda: masker(frame, out)), baseline)
+
+
+@benchmark
+def color_classifier():
+    "`ColorClassifier` label map vs a `RangeMask` pass per class, 1080p"
+    hsv = cv2.cvtColor(synthetic_frame(*IMAGE_SIZES['1080p']), cv2.COLOR_BGR2HSV)
+    labels = np.empty(hsv.shape[:2], np.uint8)
+    for n in (1, 5, 8, 16, 32):
+        ranges = {f"c{i}": HSVRange.from_colors((i * 180 // n, 40, 40),
+                                                (i * 180 // n, 220, 220), 5)
+                  for i in range(n)}
+        masks = [RangeMask(rng) for rng in ranges.values()]
+        classifier = ColorClassifier(ranges)
+
+        def per_class():
+            for i, mask in enumerate(masks):
+                labels[mask(hsv) > 0] = i + 1
+        baseline = measure(per_class)
+        report(f"{n} classes, RangeMask per class", baseline)
+        report(f"{n} classes, ColorClassifier",
+               measure(lambda: classifier.labels(hsv, labels)), baseline)
+
+
+@benchmark
+def live_histogram():
+    "Full `calcHist` vs `StreamingHistogram.update`, overlays redraw"
+    for label, shape in RESOLUTIONS.items():
+        hsv = cv2.cvtColor(synthetic_frame(*shape), cv2.COLOR_BGR2HSV)
+        baseline = measure(lambda: (
+            cv2.calcHist([hsv], [0], None, [180], [0, 180]),
+            cv2.calcHist([hsv], [1, 2], None, [32, 32], [0, 256, 0, 256])))
+        report(f"{label} full calcHist", baseline)
+        for sampling in ('stride', 'random'):
+            hist = StreamingHistogram(sampling=sampling, seed=0)
+            report(f"{label} {sampling} update", measure(
+                lambda: hist.update(hsv)), baseline)
+    for size in (256, 1024):
+        slider = SliderHSV('benchmark', size=size, histogram=hist,
+                           backend=MemoryBackend(max_frames=0))
+        report(f"{size}px render with overlays", measure(slider.render))
+
+
+@benchmark
+def suggest_hsv_range():
+    "`suggest_range` (histogram percentiles) vs `np.percentile` of ROI pixels"
+    frame = synthetic_frame(*IMAGE_SIZES['8K'])
+    for label, (height, width) in IMAGE_SIZES.items():
+        rect = Rect(0, 0, width, height)
+        baseline = measure(lambda: np.percentile(cv2.cvtColor(
+            frame[:height, :width], cv2.COLOR_BGR2HSV).reshape(-1, 3),
+            (5, 95), axis=0), repeat=1)
+        report(f"{label} ROI np.percentile", baseline)
+        report(f"{label} ROI suggest_range",
+               measure(lambda: suggest_range(frame, rect)), baseline)
+
+
+@benchmark
+def slider_mask():
+    "Range compiled each frame vs `SliderMask` cached by slider version, VGA"
+    slider = headless_slider(256)
+    frame = synthetic_frame(*IMAGE_SIZES['VGA'])
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    dst = np.empty(hsv.shape[:2], np.uint8)
+    baseline = measure(lambda: RangeMask(HSVRange.from_slider(slider, 10))(hsv, dst),
+                       repeat=1)
+    report("RangeMask compiled per frame", baseline)
+    mask = SliderMask(slider, 10)
+    report("SliderMask", measure(lambda: mask(hsv, dst)), baseline)
+    report("snapshot", measure(lambda: slider.snapshot))
+
+
+@benchmark
+def progressive_drag():
+    "Drag with a consumer masking the ROI of a 4K image, full vs progressive"
+    height, width = IMAGE_SIZES['4K']
+    frame = synthetic_frame(height, width)
+    mask = RangeMask(HSVRange.from_colors((175, 40, 40), (175, 220, 220), 10))
+
+    def consumer(rc, img):
+        roi = img[rc.y:rc.y + rc.h, rc.x:rc.x + rc.w]
+        mask(cv2.cvtColor(roi, cv2.COLOR_BGR2HSV))
+    trace = EventTrace.drag((100, 100), (width - 100, height - 100), steps=100)
+    baseline = None
+    for progressive in (False, True):
+        sel = RectSelection('benchmark', frame, (0, 0, width, height),
+                            draw_callback=consumer, progressive=progressive,
+                            backend=MemoryBackend(max_frames=0))
+        stats = replay(trace, sel.on_mouse_event)
+        report(f"progressive={progressive} p50", stats['p50'], baseline,
+               p90=stats['p90'], max=stats['max'])
+        baseline = baseline or stats['p50']
+
+
+@benchmark
+def multi_selection():
+    "Hit test and hover of `MultiRectSelection`, grid index vs linear scan"
+    height, width = IMAGE_SIZES['1080p']
+    rng = np.random.default_rng(0)
+    for n in (100, 1000):
+        xy = rng.integers(0, (width - 100, height - 100), (n, 2))
+        rects = np.hstack([xy, rng.integers(10, 100, (n, 2))])
+        sel = MultiRectSelection('benchmark', synthetic_frame(height, width),
+                                 rects=rects, backend=MemoryBackend(max_frames=0))
+        points = [tuple(p) for p in rng.integers(0, (width, height), (64, 2))]
+        i = iter(range(10 ** 9))
+
+        def linear():
+            x, y = points[next(i) % 64]
+            return next((j for j in reversed(range(n))
+                         if sel.get_cursor_area(x, y, sel.rects[j])), None)
+
+        def grid():
+            return sel.hit_test(*points[next(i) % 64])
+        baseline = measure(linear)
+        report(f"{n} rects hit_test", measure(grid), baseline)
+        trace = EventTrace([MouseEvent(k / 120, cv2.EVENT_MOUSEMOVE,
+                                       k * (width - 1) // 200, k * (height - 1) // 200)
+                            for k in range(201)])
+        stats = replay(trace, sel.on_mouse_event)
+        report(f"{n} rects hover p50", stats['p50'], p90=stats['p90'])
+
+
+@benchmark
+def frame_source():
+    "Decoding (5 ms) and processing (10 ms) of 1080p frames, inline vs prefetched"
+    height, width = IMAGE_SIZES['1080p']
+    frame = synthetic_frame(height, width)
+    count, decode_s, process_s = 60, 0.005, 0.01
+    stamps = {}
+
+    def decode(i, buf):
+        time.sleep(decode_s)
+        np.copyto(buf, frame)
+        stamps[i] = time.perf_counter()
+
+    buf = np.empty_like(frame)
+    start = time.perf_counter()
+    for i in range(count):
+        decode(i, buf)
+        time.sleep(process_s)
+    baseline = (time.perf_counter() - start) / count * 1000
+    report("inline ms/frame", baseline)
+    for policy in ('all', 'latest'):
+        ages = []
+        start = time.perf_counter()
+        with SyntheticSource(decode, frame.shape, count, policy=policy) as source:
+            for _ in source:
+                ages.append((time.perf_counter() - stamps[source.index]) * 1000)
+                time.sleep(process_s)
+        period = (time.perf_counter() - start) / len(ages) * 1000
+        report(f"{policy} ms/frame", period, baseline, dropped=source.dropped)
+        report(f"{policy} frame age p50", np.median(ages))
+
+
+@benchmark
+def interaction_latency():
+    "Replays drag, resize and hue slide traces through headless `SliderHSV`"
+    for size in (256, 1024):
+        slider = headless_slider(size)
+        third = size // 3
+        traces = {
+            'select': EventTrace.drag((third, third), (2 * third, 2 * third)),
+            'move': EventTrace.drag((size // 2, size // 2), (third, third)),
+            'resize': EventTrace.drag((third, third), (10, 10)),
+            'hue slide': EventTrace.drag((0, size + 2), (size - 1, size + 2)),
+        }
+        for name, trace in traces.items():
+            stats = replay(trace, slider.on_mouse_event)
+            report(f"{size}px {name} p50", stats['p50'],
+                   p90=stats['p90'], p99=stats['p99'])
+
+
+@benchmark
+def profiling_overhead():
+    "Cost of `profiled` entry points: plain function vs disabled vs enabled"
+    def func():
+        pass
+    wrapped = profiling.profiled('func')(func)
+    baseline = measure(func)
+    report("disabled call", measure(wrapped), baseline)
+    profiling.enable(profiling.Profiler(max_spans=1000))
+    try:
+        report("enabled call", measure(wrapped), baseline)
+    finally:
+        profiling.disable()
+
+    slider = headless_slider(256)
+    trace = EventTrace.drag((80, 80), (170, 170), steps=100)
+    baseline = None
+    for enabled in (False, True):
+        if enabled:
+            profiling.enable(profiling.Profiler())
+        try:
+            stats = replay(trace, slider.on_mouse_event)
+        finally:
+            profiling.disable()
+        report(f"select drag enabled={enabled} p50", stats['p50'], baseline)
+        baseline = baseline or stats['p50']
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    "Returns descriptions of cases which are slower than in baseline"
+    base = {(r['benchmark'], r['case']): r['ms'] for r in baseline}
+    regressions = []
+    for r in results:
+        old = base.get((r['benchmark'], r['case']))
+        if old and r['ms'] > old * (1 + tolerance):
+            regressions.append(f"{r['benchmark']}: {r['case']} "
+                               f"{old:.3f} -> {r['ms']:.3f} ms")
+    return regressions
+
+
+def main(argv=None) -> int:
+    global _current
+    parser = argparse.ArgumentParser(
+        description="Performance benchmarks on fixed synthetic inputs")
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help=f"one of {', '.join(BENCHMARKS)}; default is all")
+    parser.add_argument('--json', help="save results to JSON file")
+    parser.add_argument('--compare', help="baseline JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown relative to baseline, default is 0.25")
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    for name in args.benchmarks or BENCHMARKS:
+        print(f"# {name}")
+        _current = name
+        BENCHMARKS[name]()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(RESULTS, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(RESULTS, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
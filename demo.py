@@ -1,35 +1,44 @@
 import cv2 as cv
-import numpy as np
 
-from hsv_color_picker import SliderHSV
+from hsv_color_picker import SliderHSV, profiling
+from hsv_color_picker.histogram import StreamingHistogram
+from hsv_color_picker.masking import FrameMasker, SliderMask
+from hsv_color_picker.render import RenderScheduler
+from hsv_color_picker.sources import VideoSource
 
 
-color_slider = SliderHSV("HSV slider", normalized_display=True)
-cap = cv.VideoCapture(0, cv.CAP_DSHOW)
+scheduler = RenderScheduler()  # widget is redrawn once per `wait_key`
+color_slider = SliderHSV("HSV slider", normalized_display=True,
+                         scheduler=scheduler, histogram=StreamingHistogram())
+# frames are decoded in background, the newest one is processed
+source = VideoSource(0, cv.CAP_DSHOW, policy='latest').start()
 hue_width = 10
+# range is compiled again only when the widget changes it
+slider_mask = SliderMask(color_slider, hue_width)
+# outputs are written into reused buffers, nothing is allocated per frame
+frame_masker = FrameMasker(slider_mask)
 while True:
-    # Take each frame
-    _, frame = cap.read()
-    # Convert BGR to HSV
-    hsv = cv.cvtColor(frame, cv.COLOR_BGR2HSV)
-    # Threshold the HSV image to get only colors in selected range
-    lower_color = list(color_slider.lower_color)
-    lower_color[0] = color_slider.shift_hue(-hue_width)
-    upper_color = list(color_slider.upper_color)
-    upper_color[0] = color_slider.shift_hue(+hue_width)
-    if lower_color[0] > upper_color[0]:
-        # https://stackoverflow.com/q/30331944
-        mask1 = cv.inRange(hsv, np.uint8(lower_color), np.uint8([179, *upper_color[1:]]))
-        mask2 = cv.inRange(hsv, np.uint8([0, *lower_color[1:]]), np.uint8(upper_color))
-        mask = mask1 + mask2
-    else:
-        mask = cv.inRange(hsv, np.uint8(lower_color), np.uint8(upper_color))
-    # Bitwise-AND mask and original image
-    res = cv.bitwise_and(frame, frame, mask=mask)
+    # Take the newest frame
+    frame = source.read()
+    # Convert BGR to HSV, threshold the HSV image to get only colors in
+    # selected range (hue range may wrap around 179,
+    # see https://stackoverflow.com/q/30331944), Bitwise-AND mask and frame
+    hsv, mask, res = frame_masker(frame)
+    color_slider.update_histogram(hsv)  # overlays are drawn once per wait_key
     cv.imshow('frame',frame)
     cv.imshow('mask',mask)
     cv.imshow('res',res)
-    k = cv.waitKey(5) & 0xFF
+    k = scheduler.wait_key(5) & 0xFF
     if k == 27:
         break
+    elif k == ord('s'):  # see `python -m hsv_color_picker`
+        color_slider.save_state('state.json', slider_mask.hue_width)
+    elif k == ord('p'):  # start profiling, second press saves trace.json
+        profiler = profiling.disable()
+        if profiler:
+            print(profiler.format_stats())
+            profiler.dump_trace('trace.json')
+        else:
+            profiling.enable(profiling.Profiler())
+source.close()
 cv.destroyAllWindows()
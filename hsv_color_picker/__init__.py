@@ -1 +1,35 @@
-from .hsv_color_picker import SliderHSV
+"""
+Attributes are imported on first access, so importing the package (or its
+pure-Python `geometry` module) doesn't import OpenCV nor NumPy.
+"""
+import importlib
+
+# attribute -> module
+_lazy = {
+    'SliderHSV': '.hsv_color_picker',
+    'RectSelection': '.selection',
+    'selectROI': '.selection',
+    'Align': '.geometry',
+    'Point': '.geometry',
+    'Rect': '.geometry',
+    'RectElement': '.geometry',
+    'Vector': '.geometry',
+    'alignment_vector': '.geometry',
+    'transformed_rect': '.geometry',
+}
+
+__all__ = list(_lazy)
+
+
+def __getattr__(name: str):
+    try:
+        module = _lazy[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value  # next access doesn't call __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy))
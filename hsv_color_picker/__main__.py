@@ -0,0 +1,6 @@
+import sys
+
+from .batch import main
+
+if __name__ == '__main__':  # workers may import this module (spawn)
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+Batch masking of image folders and video files with a saved picker state.
+
+Usage: python -m hsv_color_picker STATE INPUT OUTPUT [--masked] [--workers N]
+                                  [--in-flight N] [--ext .png]
+
+`STATE` - JSON file saved with `SliderHSV.save_state`
+`INPUT` - directory of images or a video file
+`OUTPUT` - directory for images or a video file
+
+Images are processed in a process pool. Number of images in flight is
+bounded, so memory usage doesn't depend on the number of files, and
+results are written in input order.
+"""
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Callable, Deque, Iterable, Iterator, Optional
+
+import cv2
+import numpy as np
+
+from .masking import HSVRange, RangeMask
+
+IMAGE_EXTENSIONS = {'.bmp', '.jpeg', '.jpg', '.png', '.tif', '.tiff', '.webp'}
+
+_mask: Optional[RangeMask] = None  # range of a worker process
+_masked = False
+
+
+def load_state(path: str) -> HSVRange:
+    "Loads HSV range from picker state saved with `SliderHSV.save_state`"
+    with open(path) as f:
+        state = json.load(f)
+    return HSVRange.from_colors((state['hue'], *state['lower']),
+                                (state['hue'], *state['upper']),
+                                state.get('hue_width', 0))
+
+
+def _init_worker(rng: HSVRange, masked: bool):
+    global _mask, _masked
+    _mask, _masked = RangeMask(rng), masked
+
+
+def process_frame(bgr: np.ndarray) -> np.ndarray:
+    "Returns mask or masked image of the frame"
+    mask = _mask(cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV))
+    return cv2.bitwise_and(bgr, bgr, mask=mask) if _masked else mask
+
+
+def process_file(src: str, dst: str) -> str:
+    "Processes image file, returns `dst` path"
+    bgr = cv2.imread(src, cv2.IMREAD_COLOR)
+    if bgr is None:
+        raise ValueError(f"can't read image: {src}")
+    if not cv2.imwrite(dst, process_frame(bgr)):
+        raise ValueError(f"can't write image: {dst}")
+    return dst
+
+
+def ordered_map(executor: Executor, func: Callable, *iterables: Iterable,
+                in_flight: int) -> Iterator:
+    """
+    Like `Executor.map` but submits at most `in_flight` tasks ahead of
+    consumed results, so arguments are read lazily. Results are yielded
+    in input order.
+    """
+    if in_flight < 1:
+        raise ValueError("in_flight must be at least 1")
+    return _ordered_map(executor, func, zip(*iterables), in_flight)
+
+
+def _ordered_map(executor: Executor, func: Callable, args_iter: Iterator,
+                 in_flight: int) -> Iterator:
+    pending: Deque[Future] = deque()
+    for args in args_iter:
+        if len(pending) >= in_flight:
+            yield pending.popleft().result()
+        pending.append(executor.submit(func, *args))
+    while pending:
+        yield pending.popleft().result()
+
+
+def image_files(directory: str) -> Iterator[str]:
+    "Yields image file names of the directory in sorted order"
+    for name in sorted(os.listdir(directory)):
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+            yield name
+
+
+def video_frames(capture: cv2.VideoCapture) -> Iterator[np.ndarray]:
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            return
+        yield frame
+
+
+def process_directory(executor: Executor, src: str, dst: str, ext: str,
+                      in_flight: int) -> int:
+    "Processes images of `src` directory, returns number of images"
+    os.makedirs(dst, exist_ok=True)
+    names = list(image_files(src))
+    srcs = (os.path.join(src, name) for name in names)
+    dsts = (os.path.join(dst, os.path.splitext(name)[0] + ext) for name in names)
+    return sum(1 for _ in ordered_map(executor, process_file, srcs, dsts,
+                                      in_flight=in_flight))
+
+
+def process_video(executor: Executor, src: str, dst: str, masked: bool,
+                  in_flight: int, fourcc: str='MJPG') -> int:
+    "Processes frames of `src` video, returns number of frames"
+    capture = cv2.VideoCapture(src)
+    if not capture.isOpened():
+        raise ValueError(f"can't open video: {src}")
+    size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    writer = cv2.VideoWriter(dst, cv2.VideoWriter_fourcc(*fourcc),
+                             capture.get(cv2.CAP_PROP_FPS) or 25, size, masked)
+    if not writer.isOpened():
+        raise ValueError(f"can't write video: {dst}")
+    frames = 0
+    try:
+        for frame in ordered_map(executor, process_frame, video_frames(capture),
+                                 in_flight=in_flight):
+            writer.write(frame)
+            frames += 1
+    finally:
+        capture.release()
+        writer.release()
+    return frames
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m hsv_color_picker',
+        description="Masks image folders and video files with a saved HSV range")
+    parser.add_argument('state', help="picker state JSON, see `SliderHSV.save_state`")
+    parser.add_argument('input', help="directory of images or video file")
+    parser.add_argument('output', help="output directory or video file")
+    parser.add_argument('--masked', action='store_true',
+                        help="write masked images instead of masks")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes, default is number of CPUs")
+    parser.add_argument('--in-flight', type=int,
+                        help="max number of images in flight, default is 2 * workers")
+    parser.add_argument('--ext', default='.png',
+                        help="extension of output images, default is .png")
+    args = parser.parse_args(argv)
+
+    rng = load_state(args.state)
+    in_flight = args.in_flight or 2 * args.workers
+    with ProcessPoolExecutor(args.workers, initializer=_init_worker,
+                             initargs=(rng, args.masked)) as executor:
+        if os.path.isdir(args.input):
+            n = process_directory(executor, args.input, args.output, args.ext,
+                                  in_flight)
+        else:
+            n = process_video(executor, args.input, args.output, args.masked,
+                              in_flight)
+    print(f"{n} processed, range {rng.lower}-{rng.upper}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
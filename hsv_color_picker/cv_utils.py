@@ -1,25 +1,22 @@
-from enum import Flag, auto
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
 
 import cv2
 import numpy as np
 
-from .selection import Point, Vector
+# alignment is re-exported, it's imported from here by existing code
+from .geometry import Align, Point, Rect, Vector, alignment_vector
+from .profiling import profiled
 
 def_font = {'fontFace': cv2.FONT_HERSHEY_PLAIN, 'fontScale': 1, 'thickness': 1}
 
 
-class Align(Flag):
-    left = auto()
-    top = auto()
-    right = auto()
-    bottom = auto()
-    center = auto()
-
-
+@profiled('put_text_block')
 def put_text_block(img: np.ndarray, text: str, pos: Point,
                    font_params: dict=def_font, color=0,
                    lineType: int=cv2.LINE_AA,
-                   align: Align=Align.top | Align.left):
+                   align: Align=Align.top | Align.left) -> Rect:
     """
     Put multiline text block on the image.
 
@@ -31,59 +28,165 @@ def put_text_block(img: np.ndarray, text: str, pos: Point,
     `color`: Scalar - text color, defaults to black (0)
     `lineType`: LineTypes - see LineTypes in OpenCV docs, defaults to LINE_AA
     `align`: Align - text alignment
+
+    Returns: Rect - text block bounds
+    """
+    width, height, lines = text_block_layout(text, font_params)
+    pos += alignment_vector(align, width, height)
+    # cv2.rectangle(img, pos, pos + Vector(width - 1, height-1), (255, 0, 0))
+    for line, rel_pos in lines:
+        cv2.putText(img, line, pos + rel_pos, **font_params,
+                    color=color, lineType=lineType)
+    return Rect(pos.x, pos.y, width, height)
+
+
+def text_block_layout(text: str, font_params: dict=def_font):
     """
+    Measures multiline text block. Results are cached in `text_layouts`.
+
+    Returns: width, height, tuple of (line, origin relative to top-left)
+    """
+    key = text, tuple(sorted(font_params.items()))
+    layout = text_layouts.get(key)
+    if layout is not None:
+        return layout
     width, height = 0, 0
-    lines_sizes = []
-    lines_rel_pos = []
-    lines = text.splitlines()
-    for line in lines:
+    lines = []
+    for line in text.splitlines():
         # https://en.wikipedia.org/wiki/Baseline_(typography)
         (w, h), b = cv2.getTextSize(line, **font_params)
         width = max(width, w)
         height += h + b
-        lines_sizes.append(Vector(w, h + b))
-        lines_rel_pos.append(Vector(0, height - b))
-    
-    pos += alignment_vector(align, width, height)
-    # cv2.rectangle(img, pos, pos + Vector(width - 1, height-1), (255, 0, 0))
-    for i, line in enumerate(lines):
-        cv2.putText(img, line, pos + lines_rel_pos[i], **font_params,
-                    color=color, lineType=lineType)
+        lines.append((line, Vector(0, height - b)))
+    layout = width, height, tuple(lines)
+    text_layouts.put(key, layout)
+    return layout
+
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache limited by memory budget.
+
+    `max_bytes` - memory budget, least recently used items are evicted when
+                  it's exceeded. Items larger than the budget are not stored
+    `sizeof` - function which returns size of an item in bytes,
+               default is `item.nbytes` (numpy arrays)
+
+    `hits`, `misses` - lookup counters, see also `reset_stats`
+    """
+
+    def __init__(self, max_bytes: int,
+                 sizeof: Callable[[Any], int]=lambda item: item.nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        "Returns cached item and marks it as recently used or None"
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item
+
+    def put(self, key: Hashable, item: Any) -> bool:
+        """
+        Stores item in the cache evicting least recently used items if needed.
+
+        Returns: False if item doesn't fit into memory budget
+        """
+        size = self.sizeof(item)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self.sizeof(self._items.pop(key))
+            while self._items and self.nbytes + size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= self.sizeof(evicted)
+            self._items[key] = item
+            self.nbytes += size
+        return True
+
+    def fits(self, size: int) -> bool:
+        "Checks if an item of `size` bytes can be stored without eviction"
+        return self.nbytes + size <= self.max_bytes
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+    def reset_stats(self):
+        self.hits, self.misses = 0, 0
 
 
-def alignment_vector(align: Align, width: int, height: int) -> Vector:
+class BufferPool:
     """
-    Calculates displacement for a block of specified width and height.
-    eg. top-left==(0, 0), bottom-right==(-width, -height)
-    NOTE: if `Align` flag is specified only for one axis then `center` flag is
-          used for the other axis, eg. left==left|center, center==center
-
-          left   center  right
-       top +-------+-------+
-           |               |
-    center +       +       +
-           |               |
-    bottom +-------+-------+
-
-    Arguments
-    `align`: Align - block alignment
-    `width`: int - block width
-    `height`: int - block height
-
-    Returns: Vector
+    Thread-safe pool of reusable arrays for per-frame outputs, pass them as
+    `dst` to OpenCV calls. Each (name, shape, dtype) has a ring of `depth`
+    buffers returned in turn, so with `depth=2` outputs of frame N stay valid
+    while frame N+1 is computed.
+
+    `depth` - number of buffers in each ring. Default is 2
+
+    `requests`, `allocations` - counters, in steady state only `requests`
+                                grow. See also `reset_stats`
+    `nbytes` - size of all allocated buffers
     """
-    if Align.left in align:
-        x = 0
-    elif Align.right in align:
-        x = -width + 1
-    else:  # h-center
-        x = round(-width/2)
-
-    if Align.top in align:
-        y = 0
-    elif Align.bottom in align:
-        y = -height + 1
-    else:  # v-center
-        y = round(-height/2)
-
-    return Vector(x, y)
+
+    def __init__(self, depth: int=2):
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
+        self.depth = depth
+        self.requests = 0
+        self.allocations = 0
+        self.nbytes = 0
+        self._rings: Dict[Hashable, Tuple[List[np.ndarray], int]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: Hashable, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """
+        Returns next buffer of the ring of `name`, eg. 'hsv', 'mask'.
+        Content of the buffer is undefined.
+        """
+        key = name, tuple(shape), np.dtype(dtype)
+        with self._lock:
+            self.requests += 1
+            buffers, i = self._rings.get(key, ([], -1))
+            i = (i + 1) % self.depth
+            if i == len(buffers):
+                buffers.append(np.empty(shape, dtype))
+                self.allocations += 1
+                self.nbytes += buffers[i].nbytes
+            self._rings[key] = buffers, i
+            return buffers[i]
+
+    def like(self, name: Hashable, arr: np.ndarray) -> np.ndarray:
+        "Returns next buffer of the ring of `name` of the shape and dtype of `arr`"
+        return self.get(name, arr.shape, arr.dtype)
+
+    def clear(self):
+        with self._lock:
+            self._rings.clear()
+            self.nbytes = 0
+
+    def reset_stats(self):
+        self.requests, self.allocations = 0, 0
+
+
+# measured text blocks, see `text_block_layout`
+text_layouts = LRUCache(2**20, sizeof=lambda layout: 100 + 100 * len(layout[2]))
@@ -0,0 +1,204 @@
+"""
+Display backends and mouse event traces.
+
+`HighGUIBackend` shows images with OpenCV HighGUI (default),
+`MemoryBackend` records frames in memory, so widgets can be used on machines
+without a display. See `get_backend`, `set_backend`.
+
+`EventTrace` records or generates mouse events which can be replayed through
+a mouse callback with `replay` to measure render latency.
+"""
+import json
+import time
+from collections import defaultdict, deque
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .profiling import profiled
+
+MouseCallback = Callable[[int, int, int, int, object], object]
+
+
+class HighGUIBackend:
+    "Displays images with OpenCV HighGUI"
+
+    @profiled('imshow', frame=lambda self, window, img: window)
+    def show(self, window: str, img: np.ndarray):
+        cv2.imshow(window, img)
+
+    def set_mouse_callback(self, window: str, callback: MouseCallback):
+        cv2.setMouseCallback(window, callback)
+
+    def window_image_rect(self, window: str) -> Tuple[int, int, int, int]:
+        return cv2.getWindowImageRect(window)
+
+    def wait_key(self, delay: int=0) -> int:
+        return cv2.waitKey(delay)
+
+
+class MemoryBackend:
+    """
+    Records displayed frames in memory.
+
+    `window_size` - (width, height) of a window which hasn't shown a frame yet
+    `max_frames` - number of last frames kept per window. Default is 1,
+                   0 - frames are only counted
+    `keys` - key codes returned by `wait_key` one by one, then -1
+
+    `frames` - dict of last frames of each window
+    `shown` - dict of number of frames shown in each window
+    """
+
+    def __init__(self, window_size: Tuple[int, int]=(640, 480),
+                 max_frames: int=1, keys: List[int]=()):
+        self.window_size = window_size
+        self.frames: Dict[str, Deque[np.ndarray]] = \
+            defaultdict(lambda: deque(maxlen=max_frames))
+        self.shown: Dict[str, int] = defaultdict(int)
+        self.callbacks: Dict[str, MouseCallback] = {}
+        self.keys = deque(keys)
+
+    @profiled('MemoryBackend.show', frame=lambda self, window, img: window)
+    def show(self, window: str, img: np.ndarray):
+        if self.frames[window].maxlen:
+            self.frames[window].append(np.array(img))  # display buffers are reused
+        self.shown[window] += 1
+
+    def set_mouse_callback(self, window: str, callback: MouseCallback):
+        self.callbacks[window] = callback
+
+    def window_image_rect(self, window: str) -> Tuple[int, int, int, int]:
+        if self.frames[window]:
+            height, width = self.frames[window][-1].shape[:2]
+            return 0, 0, width, height
+        return (0, 0, *self.window_size)
+
+    def wait_key(self, delay: int=0) -> int:
+        return self.keys.popleft() if self.keys else -1
+
+    def frame(self, window: str) -> Optional[np.ndarray]:
+        "Returns the last frame shown in the window or None"
+        return self.frames[window][-1] if self.frames[window] else None
+
+    def mouse_event(self, window: str, event: int, x: int, y: int, flags: int=0):
+        "Sends mouse event to the window"
+        return self.callbacks[window](event, x, y, flags, None)
+
+
+_backend = HighGUIBackend()
+
+
+def get_backend():
+    "Returns default display backend"
+    return _backend
+
+
+def set_backend(backend):
+    "Sets default display backend for widgets created afterwards"
+    global _backend
+    _backend = backend
+
+
+class MouseEvent(NamedTuple):
+    t: float  # seconds since the start of a trace
+    event: int
+    x: int
+    y: int
+    flags: int = 0
+
+
+class EventTrace:
+    """
+    Sequence of mouse events. Can be recorded from a live window (see `record`),
+    generated (see `drag`), saved to and loaded from JSON file.
+    """
+
+    def __init__(self, events: List[MouseEvent]=None):
+        self.events = list(events or [])
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def record(self, callback: MouseCallback) -> MouseCallback:
+        """
+        Wraps mouse callback to record events passed to it, eg.
+        `cv2.setMouseCallback(wnd, trace.record(slider.on_mouse_event))`
+        """
+        start = time.perf_counter()
+
+        def wrapper(event, x, y, flags, param):
+            t = time.perf_counter() - start
+            self.events.append(MouseEvent(t, event, x, y, flags))
+            return callback(event, x, y, flags, param)
+        return wrapper
+
+    @classmethod
+    def drag(cls, start: Tuple[int, int], end: Tuple[int, int], steps: int=50,
+             interval: float=1 / 120) -> "EventTrace":
+        """
+        Generates left button drag from `start` to `end` point, eg. resizing
+        a selection or sliding hue.
+
+        `steps` - number of mouse move events
+        `interval` - time between events in seconds
+        """
+        (x0, y0), (x1, y1) = start, end
+        events = [MouseEvent(0., cv2.EVENT_LBUTTONDOWN, x0, y0,
+                             cv2.EVENT_FLAG_LBUTTON)]
+        for i in range(1, steps + 1):
+            events.append(MouseEvent(i * interval, cv2.EVENT_MOUSEMOVE,
+                                     x0 + round((x1 - x0) * i / steps),
+                                     y0 + round((y1 - y0) * i / steps),
+                                     cv2.EVENT_FLAG_LBUTTON))
+        events.append(MouseEvent((steps + 1) * interval, cv2.EVENT_LBUTTONUP,
+                                 x1, y1))
+        return cls(events)
+
+    def __add__(self, other: "EventTrace") -> "EventTrace":
+        "Concatenates traces, `other` is shifted in time"
+        shift = self.events[-1].t if self.events else 0.
+        return EventTrace(self.events + [e._replace(t=e.t + shift)
+                                         for e in other.events])
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump([list(e) for e in self.events], f)
+
+    @classmethod
+    def load(cls, path: str) -> "EventTrace":
+        with open(path) as f:
+            return cls([MouseEvent(*e) for e in json.load(f)])
+
+
+def percentiles(samples: List[float], ps=(50, 90, 99)) -> Dict[str, float]:
+    "Returns dict of percentiles and max of samples"
+    if not samples:
+        return {}
+    ret = {f"p{p}": float(np.percentile(samples, p)) for p in ps}
+    ret['max'] = max(samples)
+    return ret
+
+
+def replay(trace: EventTrace, callback: MouseCallback,
+           flush: Callable[[], object]=None) -> Dict[str, float]:
+    """
+    Replays trace through the mouse callback as fast as possible.
+
+    Arguments:
+    `trace` - mouse events
+    `callback` - mouse callback, eg. `SliderHSV.on_mouse_event`
+    `flush` - function which is called after each event and is included in
+              latency, eg. `RenderScheduler.flush`
+
+    Returns: per-event latency percentiles in milliseconds, see `percentiles`
+    """
+    latencies = []
+    for e in trace.events:
+        start = time.perf_counter()
+        callback(e.event, e.x, e.y, e.flags, None)
+        if flush:
+            flush()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {'events': len(latencies), **percentiles(latencies)}
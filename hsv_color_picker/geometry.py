@@ -0,0 +1,264 @@
+"""
+Pure-Python geometry of selections: points, vectors, rects, rect elements
+and alignment. Doesn't import OpenCV nor NumPy, so tools which only need
+geometry start fast.
+"""
+from dataclasses import dataclass
+from enum import Flag, auto
+from typing import NamedTuple, Optional, Tuple
+
+
+# 3.6+ https://www.geeksforgeeks.org/typing-namedtuple-improved-namedtuples/
+class Point(NamedTuple):
+    "Represents a point. Values can be accessed as .x, .y or by indexing (x=0, y=1)"
+    x: int = 0
+    y: int = 0
+
+    def __add__(self, other: "Point") -> "Vector":
+        return Vector(self.x + other.x, self.y + other.y)
+
+    def __sub__(self, other: "Point") -> "Vector":
+        return Vector(self.x - other.x, self.y - other.y)
+
+
+class Vector(Point):
+    "Vector is used in translation operations"
+    __slots__ = ()  # no instance dict, like Point
+
+    @property
+    def proj_y(self):
+        "Projection on Y axis"
+        return Vector(y=self.y)
+
+    @property
+    def proj_x(self):
+        "Projection on X axis"
+        return Vector(x=self.x)
+
+    @property
+    def neg_x(self):
+        "Set X to -X"
+        return Vector(-self.x, self.y)
+
+    @property
+    def neg_y(self):
+        "Set Y to -Y"
+        return Vector(self.x, -self.y)
+
+    def __mul__(self, coef: float):
+        # multiply coordinates by coefficient
+        return Vector(round(self.x * coef), round(self.y * coef))
+
+    def __eq__(self, other: "Vector") -> bool:
+        return self.x == other.x and self.y == other.y
+
+
+# 3.7+ https://jerrynsh.com/all-you-need-to-know-about-data-classes-in-python/
+@dataclass(init=False)  # slots and field defaults can't be combined before 3.10
+class Rect:
+    """
+    Represents a rectangle.
+    `points` (prop.) - get coordinates of each corner as a tuple of Points
+    """
+    __slots__ = ('x', 'y', 'w', 'h', '_points')
+    x: int
+    y: int
+    w: int
+    h: int
+
+    def __init__(self, x: int=0, y: int=0, w: int=0, h: int=0):
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self._points = None
+
+    @property
+    def points(self) -> Tuple[Point, Point, Point, Point]:
+        """
+        Return coordinates of top-left, top-right, bottom-right and bottom-left corners as Points
+        """
+        x, y, r, b = self.x, self.y, self.x + self.w - 1, self.y + self.h - 1
+        points = self._points
+        # corners are cached until the rect is changed
+        if points is not None:
+            tl, _, br, _ = points
+            if tl.x == x and tl.y == y and br.x == r and br.y == b:
+                return points
+        points = self._points = Point(x, y), Point(r, y), Point(r, b), Point(x, b)
+        return points
+
+    def __rshift__(self, other: Vector) -> "Rect":
+        "Translate"
+        return Rect(self.x + other.x, self.y + other.y, self.w, self.h)
+
+    def __lshift__(self, other: Vector) -> "Rect":
+        "Translate"
+        return Rect(self.x - other.x, self.y - other.y, self.w, self.h)
+
+    def __add__(self, other: Vector) -> "Rect":
+        "Resize"
+        return Rect(self.x, self.y, self.w + other.x, self.h + other.y)
+
+    def __sub__(self, other: Vector) -> "Rect":
+        "Resize"
+        return Rect(self.x, self.y, self.w - other.x, self.h - other.y)
+    
+    def __bool__(self) -> bool:
+        return self.w != 0 and self.h != 0
+
+    def union(self, other: "Rect") -> "Rect":
+        "Bounding rect of both rects, empty rects are ignored"
+        if not other:
+            return Rect(self.x, self.y, self.w, self.h)
+        if not self:
+            return Rect(other.x, other.y, other.w, other.h)
+        x, y = min(self.x, other.x), min(self.y, other.y)
+        return Rect(x, y, max(self.x + self.w, other.x + other.w) - x,
+                    max(self.y + self.h, other.y + other.h) - y)
+
+    def intersection(self, other: "Rect") -> "Rect":
+        "Common area of both rects or empty rect"
+        x, y = max(self.x, other.x), max(self.y, other.y)
+        w = min(self.x + self.w, other.x + other.w) - x
+        h = min(self.y + self.h, other.y + other.h) - y
+        return Rect(x, y, w, h) if w > 0 and h > 0 else Rect()
+
+    def normalize(self):
+        """
+        Flip coordinates if width or height is zero or negative.
+
+        NOTE: Valid rectangle cannot have zero size, eg.
+        - If `w==1` and we move right side 1px to the left, `w` becomes 0.
+        - This means that we need to move left `x` 1px to the left
+        - Now `w` becomes 2 'cause left and right sides are on adjacent pixels
+        """
+        if self.w <= 0:
+            self.x += self.w - 1
+            self.w = -self.w + 2
+        if self.h <= 0:
+            self.y += self.h - 1
+            self.h = -self.h + 2
+
+
+# https://docs.python.org/3/library/enum.html#flag
+class RectElement(Flag):
+    left = auto()    # sides
+    top = auto()     #
+    right = auto()   #
+    bottom = auto()  #
+    topleft, topright = top | left, top | right  # top corners
+    bottomright, bottomleft = bottom | right, bottom | left  # bottom corners
+    area = auto()  # inner area
+    from_center = auto()
+    # TODO: point element for point selection and moving
+
+
+# Coefficients of vector components added to x, y, w, h when element is
+# dragged and how much of the exceeding size is clipped by bounds, eg.
+# dragging top-left corner moves the corner and shrinks the rect
+_transform_coefs = {
+    RectElement.area: (1, 1, 0, 0, 0),
+    RectElement.topleft: (1, 1, -1, -1, 1),
+    RectElement.topright: (0, 1, 1, -1, 1),
+    RectElement.bottomright: (0, 0, 1, 1, 1),
+    RectElement.bottomleft: (1, 0, -1, 1, 1),
+    RectElement.top: (0, 1, 0, -1, 1),
+    RectElement.right: (0, 0, 1, 0, 1),
+    RectElement.bottom: (0, 0, 0, 1, 1),
+    RectElement.left: (1, 0, -1, 0, 1),
+    RectElement.from_center: (-1, -1, 2, 2, 2),  # TODO: mirroring
+}
+
+# elements under cursor by position relative to (top, bottom) and
+# (left, right) sides, see `RectSelection.get_cursor_area`
+_cursor_areas = tuple(tuple(v | h for h in (RectElement(0), RectElement.left,
+                                            RectElement.right))
+                      for v in (RectElement(0), RectElement.top, RectElement.bottom))
+
+
+def transformed_rect(rect: Rect, el: Optional[RectElement], vec: Vector,
+                     bounds: Rect) -> Rect:
+    """
+    Returns `rect` moved or resized by dragging element `el` by `vec`,
+    normalized and clipped by `bounds`
+    """
+    try:
+        ax, ay, aw, ah, clip = _transform_coefs[el]
+    except KeyError:
+        raise ValueError(el) from None
+    dx, dy = vec.x, vec.y
+    x, y = rect.x + ax * dx, rect.y + ay * dy
+    w, h = rect.w + aw * dx, rect.h + ah * dy
+    if w <= 0:  # see `Rect.normalize`
+        x, w = x + w - 1, -w + 2
+    if h <= 0:
+        y, h = y + h - 1, -h + 2
+    b_l, b_t = bounds.x, bounds.y
+    b_r, b_b = b_l + bounds.w - 1, b_t + bounds.h - 1
+    # if rect inside bounds left/top > 0, right/bottom < 0
+    v_l, v_t = x - b_l, y - b_t
+    v_r, v_b = x + w - 1 - b_r, y + h - 1 - b_b
+    # Left X is out of bounds AND exceeds MORE than the opposite side;
+    # when whole rectangle is moved its size doesn't change (`clip` is 0),
+    # both left and right parts are clipped if `from_center` (`clip` is 2)
+    if v_l < 0 and (abs(v_l) - v_r) > 0:  # left X bound
+        x = b_l
+        w += v_l * clip
+    elif v_r > 0:  # right X bound
+        w -= v_r * clip
+        x = b_r - w + 1
+    # Top Y is out of bounds AND exceeds MORE than the opposite side
+    if v_t < 0 and (abs(v_t) - v_b) > 0:  # top Y bound
+        y = b_t
+        h += v_t * clip
+    elif v_b > 0:  # bottom Y bound
+        h -= v_b * clip
+        y = b_b - h + 1
+    return Rect(x, y, w, h)
+
+
+class Align(Flag):
+    left = auto()
+    top = auto()
+    right = auto()
+    bottom = auto()
+    center = auto()
+
+
+def alignment_vector(align: Align, width: int, height: int) -> Vector:
+    """
+    Calculates displacement for a block of specified width and height.
+    eg. top-left==(0, 0), bottom-right==(-width, -height)
+    NOTE: if `Align` flag is specified only for one axis then `center` flag is
+          used for the other axis, eg. left==left|center, center==center
+
+          left   center  right
+       top +-------+-------+
+           |               |
+    center +       +       +
+           |               |
+    bottom +-------+-------+
+
+    Arguments
+    `align`: Align - block alignment
+    `width`: int - block width
+    `height`: int - block height
+
+    Returns: Vector
+    """
+    if Align.left in align:
+        x = 0
+    elif Align.right in align:
+        x = -width + 1
+    else:  # h-center
+        x = round(-width/2)
+
+    if Align.top in align:
+        y = 0
+    elif Align.bottom in align:
+        y = -height + 1
+    else:  # v-center
+        y = round(-height/2)
+
+    return Vector(x, y)
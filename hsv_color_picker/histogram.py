@@ -0,0 +1,114 @@
+"""
+Live histograms of video frames with bounded per-frame cost,
+see `StreamingHistogram`
+"""
+import math
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class StreamingHistogram:
+    """
+    Hue histogram and saturation x brightness density of a frame stream.
+    Each frame is subsampled to at most `budget` pixels and histograms are
+    smoothed with exponential moving average, so the cost per frame doesn't
+    depend on frame size.
+
+    `budget` - max number of pixels sampled per frame. Default is 65536
+    `sampling` - 'stride' (regular grid) or 'random' (new random pixels
+                 each frame). Default is 'stride'
+    `alpha` - EMA weight of a new frame. Default is 0.2
+    `sv_bins` - number of saturation and brightness bins. Default is 32
+    `seed` - seed of random sampling
+
+    `hue` - hue histogram, 180 bins, sums to 1
+    `sv` - (saturation, brightness) histogram, `sv_bins` x `sv_bins`, sums to 1
+    `frames` - number of frames added
+    """
+
+    def __init__(self, budget: int=65536, sampling: str='stride',
+                 alpha: float=0.2, sv_bins: int=32, seed: int=None):
+        if sampling not in ('stride', 'random'):
+            raise ValueError(f"unknown sampling: {sampling}")
+        self.budget = budget
+        self.sampling = sampling
+        self.alpha = alpha
+        self.sv_bins = sv_bins
+        self.rng = np.random.default_rng(seed)
+        self.hue: Optional[np.ndarray] = None
+        self.sv: Optional[np.ndarray] = None
+        self.frames = 0
+
+    def sample(self, hsv: np.ndarray) -> np.ndarray:
+        "Returns at most `budget` pixels of the image, shape (n, 1, 3)"
+        height, width = hsv.shape[:2]
+        if self.sampling == 'random':
+            n = min(self.budget, height * width)
+            if hsv.flags.c_contiguous:  # `take` is faster than fancy indexing
+                idx = self.rng.integers(0, height * width, n)
+                return np.take(hsv.reshape(-1, 3), idx, axis=0).reshape(-1, 1, 3)
+            ys = self.rng.integers(0, height, n)
+            xs = self.rng.integers(0, width, n)
+            return hsv[ys, xs].reshape(-1, 1, 3)
+        step = max(math.ceil(math.sqrt(height * width / self.budget)), 1)
+        return np.ascontiguousarray(hsv[::step, ::step])
+
+    def update(self, hsv: np.ndarray):
+        "Adds HSV frame (or its region) to the histograms"
+        pixels = self.sample(hsv)
+        n = pixels.shape[0] * pixels.shape[1]
+        if not n:
+            return
+        bins = self.sv_bins
+        hue = cv2.calcHist([pixels], [0], None, [180], [0, 180]).ravel() / n
+        sv = cv2.calcHist([pixels], [1, 2], None, [bins, bins],
+                          [0, 256, 0, 256]) / n
+        if self.frames:
+            a = self.alpha
+            cv2.addWeighted(hue, a, self.hue, 1 - a, 0, dst=self.hue)
+            cv2.addWeighted(sv, a, self.sv, 1 - a, 0, dst=self.sv)
+        else:
+            self.hue, self.sv = hue, sv
+        self.frames += 1
+
+    def reset(self):
+        self.hue = self.sv = None
+        self.frames = 0
+
+    def draw_sv(self, plane: np.ndarray, opacity: float=0.6,
+                colormap: int=cv2.COLORMAP_INFERNO):
+        """
+        Blends density heat-map into saturation/brightness plane of
+        `SliderHSV` in place (Y is saturation, X is brightness).
+        Empty bins are left transparent.
+        """
+        if self.sv is None:
+            return
+        height, width = plane.shape[:2]
+        density = np.sqrt(self.sv / max(self.sv.max(), 1e-12))
+        heat = cv2.applyColorMap(np.uint8(density * 255), colormap)
+        weights = np.float32(density > 0) * np.float32(opacity)
+        heat = cv2.resize(heat, (width, height), interpolation=cv2.INTER_NEAREST)
+        weights = cv2.resize(weights, (width, height),
+                             interpolation=cv2.INTER_NEAREST)
+        cv2.blendLinear(heat, plane, weights, 1 - weights, dst=plane)
+
+    def draw_hue(self, strip: np.ndarray, colors: np.ndarray, hues: np.ndarray):
+        """
+        Draws hue histogram as bars into `strip` in place.
+
+        Arguments:
+        `strip` - BGR image, bars are drawn from its bottom
+        `colors` - (width, 3) bar colors, eg. a row of `SliderHSV.h_comp`
+        `hues` - (width,) hue of each column
+        """
+        strip[:] = 0
+        if self.hue is None:
+            return
+        height = strip.shape[0]
+        bars = self.hue[hues]
+        bars = np.int32(np.ceil(bars / max(bars.max(), 1e-12) * height))
+        filled = np.arange(height)[::-1, None] < bars
+        strip[filled] = np.broadcast_to(colors, strip.shape)[filled]
@@ -1,8 +1,44 @@
+import json
+import math
+import threading
+from typing import NamedTuple, Tuple
+
 import cv2
 import numpy as np
 
-from .cv_utils import put_text_block, Align, def_font
-from .selection import Rect, RectSelection, Vector
+from .cv_utils import LRUCache, put_text_block, Align, def_font
+from .display import get_backend
+from .histogram import StreamingHistogram
+from .masking import HSVRange
+from .profiling import profiled
+from .render import RenderScheduler
+from .selection import Point, Rect, RectSelection, Vector
+
+
+def hue_coefficients(hue: int) -> Tuple[float, float, float]:
+    """
+    Returns (b, g, r) coefficients such that HSV color with the hue
+    is `V * (1 - S * c)` in each BGR channel (S is 0-1), see `cvtColor`
+    """
+    h = hue * 2 / 60  # OpenCV hue is 0-179
+    sector, f = int(h) % 6, h - int(h)
+    r, g, b = ((0, 1 - f, 1), (f, 0, 1), (1, 0, 1 - f),
+               (1, f, 0), (1 - f, 1, 0), (0, 1, f))[sector]
+    return b, g, r
+
+
+class RangeSnapshot(NamedTuple):
+    """
+    Immutable state of `SliderHSV` range. `version` increases with each
+    change of the range (assigning the same range keeps it), so compiled
+    thresholds can be cached by version.
+    """
+    version: int
+    lower_color: Tuple[int, int, int]
+    upper_color: Tuple[int, int, int]
+
+    def range(self, hue_width: int=0) -> HSVRange:
+        return HSVRange.from_colors(self.lower_color, self.upper_color, hue_width)
 
 
 class SliderHSV:
@@ -14,6 +50,21 @@ class SliderHSV:
     `slider_height` - hue slider height. Default is 16px
     `normalized_display` - display normalized values. Default is False
                            Hue 0-360, saturation/brightness 0-100%
+    `plane_cache_bytes` - memory budget of rendered saturation/brightness
+                          planes cache (one plane per hue value). Default is 64MB
+    `scheduler` - render scheduler, mouse events only request redraws and
+                  widget is rendered by the scheduler (see `RenderScheduler`).
+                  The first render is requested too, so the widget images
+                  are built on the first `wait_key`. Without a scheduler the
+                  widget is rendered when it's created
+    `backend` - display backend, default is `display.get_backend()`
+    `histogram` - histogram of live frames shown as S/B density heat-map
+                  and hue histogram strip under the hue slider,
+                  see `update_histogram`. Default is None - no overlays
+    `histogram_height` - hue histogram strip height. Default is 24px
+
+    Range is changed by GUI callbacks, use `snapshot` to read it
+    consistently from other threads.
     """
     sliding = None
     last_cursor_area = ""
@@ -24,34 +75,39 @@ class SliderHSV:
     font = cv2.FONT_HERSHEY_PLAIN
 
     def __init__(self, window_name: str, size: int=256, slider_height: int=16,
-                 normalized_display=False):
+                 normalized_display=False, plane_cache_bytes: int=64 * 2**20,
+                 scheduler: RenderScheduler=None, backend=None,
+                 histogram: StreamingHistogram=None, histogram_height: int=24):
         self.window_name = window_name
         self.size = size  # px
         self.slider_height = slider_height  # px
         self.normalized_display = normalized_display
+        self.scheduler = scheduler
+        self.backend = backend or get_backend()
+        self.histogram = histogram
+        self.histogram_height = histogram_height if histogram else 0
         self.pt = 0, 0
-        self.hue = 0
+        self._lock = threading.RLock()
+        self._snapshot = RangeSnapshot(0, (0, 0, 0), (0, 0, 0))
+        self._hue = 0
         self._lower_color = [0, 0]
         self._upper_color = [0, 0]
 
-        h_comp = np.uint8([np.linspace([0., 255., 255.], [179., 255., 255.], self.size)])
-        h_comp = np.broadcast_to(h_comp, (self.slider_height, self.size, 3))
-        self.h_comp = cv2.cvtColor(h_comp, cv2.COLOR_HSV2BGR)
+        self._h_comp = None  # hue slider, built on first render (see `h_comp`)
 
-        tmp = np.empty((size * size * 3), dtype=np.uint8)
-        _0_255 = np.linspace(0., 255., self.size)
-        # tmp[0::3] = 0  # will be replaced with hue values later
-        tmp[1::3] = _0_255.repeat(self.size)  # repeats each element then concatenates
-        tmp[2::3] = np.tile(_0_255, self.size)  # concatenates array copies
-        self.tpl_hsv = tmp.reshape(self.size, self.size, 3)
+        # saturation (Y) and brightness (X) of plane pixels
+        self.sv_ramp = np.uint8(np.linspace(0., 255., self.size))
+        self._sv_product = None
+        self.plane_cache = LRUCache(plane_cache_bytes)
 
         im_stub = np.zeros(1)
-        cv2.imshow(window_name, im_stub)
+        self.backend.show(window_name, im_stub)
         self.sel = RectSelection(window_name, im_stub, (0, 0, size, size),
                                  draw_callback=self.on_sel_update,
-                                 selection_callback=self.on_selection)
-        cv2.setMouseCallback(window_name, self.on_mouse_event)
-        self.set_value(0)
+                                 selection_callback=self.on_selection,
+                                 scheduler=scheduler, backend=self.backend)
+        self.backend.set_mouse_callback(window_name, self.on_mouse_event)
+        self.request_render()  # hue 0
 
     def pos_to_hue(self, x):
         return int(x / (self.size - 1) * 179)
@@ -74,6 +130,7 @@ class SliderHSV:
         """
         return tuple(np.int16(np.array(h) / 255 * (self.size - 1)))
 
+    @profiled('SliderHSV.on_mouse_event')
     def on_mouse_event(self, event, x, y, flags, param):
         # https://docs.opencv.org/4.x/db/d5b/tutorial_py_mouse_handling.html
         if self.sel.on_mouse_event(event, x, y, flags, param):
@@ -89,7 +146,7 @@ class SliderHSV:
         elif event == cv2.EVENT_LBUTTONUP:
             self.sliding = None
     
-    def on_sel_update(self, rect: Rect, img: np.ndarray):
+    def on_sel_update(self, rect: Rect, img: np.ndarray) -> Rect:
         lt, _, br, _ = rect.points
         lsat, rsat = self.pos_to_val(lt.y), self.pos_to_val(br.y)
         lbri, rbri = self.pos_to_val(lt.x), self.pos_to_val(br.x)
@@ -98,42 +155,197 @@ class SliderHSV:
             lbri, rbri = f"{lbri / 255:.1%}", f"{rbri / 255:.1%}"
         text = f"S.{lsat}\nB.{lbri}"
         color = 0 if lt.x > self.size / 3 else (255, 255, 255)
-        put_text_block(img, text, lt + Vector(y=1), self.font_params, color)
+        drawn = put_text_block(img, text, lt + Vector(y=1), self.font_params, color)
         text = f"S.{rsat}\nB.{rbri}"
         color = 0 if br.x - 32 > self.size / 3 else (255, 255, 255)
-        put_text_block(img, text, br, self.font_params, color,
-                       align=Align.bottom | Align.right)
+        return drawn.union(put_text_block(img, text, br, self.font_params, color,
+                                          align=Align.bottom | Align.right))
 
     def on_selection(self, rc: Rect):
         lt, _, rb, _ = rc.points
         # X is brightness, Y is saturation
-        self._lower_color = [self.pos_to_val(lt.y), self.pos_to_val(lt.x)]
-        self._upper_color = [self.pos_to_val(rb.y), self.pos_to_val(rb.x)]
+        with self._lock:
+            self._lower_color = [self.pos_to_val(lt.y), self.pos_to_val(lt.x)]
+            self._upper_color = [self.pos_to_val(rb.y), self.pos_to_val(rb.x)]
+            self._publish()
+
+    def _publish(self):
+        "Replaces snapshot if the range has changed, `_lock` must be held"
+        lower = (self._hue, *self._lower_color)
+        upper = (self._hue, *self._upper_color)
+        old = self._snapshot
+        if (lower, upper) != (old.lower_color, old.upper_color):
+            self._snapshot = RangeSnapshot(old.version + 1, lower, upper)
 
+    @property
+    def snapshot(self) -> RangeSnapshot:
+        "Current range, consistent even if it's being changed by GUI thread"
+        with self._lock:
+            return self._snapshot
+
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+
+    @property
+    def hue(self) -> int:
+        return self._hue
+
+    @hue.setter
+    def hue(self, hue: int):
+        with self._lock:
+            self._hue = hue
+            self._publish()
+
+    @profiled('SliderHSV.set_value')
     def set_value(self, hue):
-        hue = max(min(hue, 179), 0)
+        self.hue = max(min(hue, 179), 0)
+        self.request_render()
+
+    def set_range(self, rng) -> int:
+        """
+        Sets hue to the middle of hue range of `rng` (`masking.HSVRange`,
+        eg. from `masking.suggest_range`) and selects its
+        saturation/brightness range.
+
+        Returns: hue width which makes `HSVRange.from_slider` cover the range
+        """
+        (lower_hue, lsat, lbri), (upper_hue, rsat, rbri) = rng
+        span = (upper_hue - lower_hue) % 180
+        # lower bounds are rounded down, upper ones up
+        to_pos = lambda v, r: int(r(v / 255 * (self.size - 1)))
+        lt = Point(to_pos(lbri, math.floor), to_pos(lsat, math.floor))
+        br = Point(to_pos(rbri, math.ceil), to_pos(rsat, math.ceil))
+        with self._lock:  # readers don't see a partially set range
+            self.sel.set_selection(Rect(lt.x, lt.y, br.x - lt.x + 1,
+                                        br.y - lt.y + 1))
+            self.hue = (lower_hue + span // 2) % 180
+        self.request_render()
+        return span - span // 2
+
+    def save_state(self, path: str, hue_width: int=0):
+        """
+        Saves hue, saturation/brightness bounds and `hue_width` to JSON file,
+        see `python -m hsv_color_picker` and `batch.load_state`
+        """
+        snapshot = self.snapshot
+        with open(path, 'w') as f:
+            json.dump({'hue': snapshot.lower_color[0],
+                       'lower': snapshot.lower_color[1:],
+                       'upper': snapshot.upper_color[1:],
+                       'hue_width': hue_width}, f)
+
+    def update_histogram(self, hsv: np.ndarray):
+        """
+        Adds HSV frame to `histogram` and requests redraw. Overlays are
+        drawn on redraw only, so with `scheduler` they are updated once per
+        `wait_key` however many frames are added.
+        """
+        self.histogram.update(hsv)
+        self.request_render()
+
+    def request_render(self):
+        if self.scheduler:
+            self.scheduler.request(self, self.render)
+        else:
+            self.render()
+
+    @profiled('SliderHSV.render')
+    def render(self):
+        "Renders widget with current hue value"
+        hue = self.hue
         x_pos = self.hue_to_pos(hue)
         self.sv = self.create_sat_br_rect(hue)
         cv2.line(self.sv, (x_pos, self.size), (x_pos, self.size + self.slider_height), (255, 255, 255), 2)
         disp_hue = f"{hue/179*360:.1f}" if self.normalized_display else str(hue)
         cv2.putText(self.sv, f"Hue {disp_hue}", (0, self.size + self.slider_height - 2), cv2.FONT_HERSHEY_PLAIN, 1, 0, lineType=cv2.LINE_AA)
-        self.hue = hue
+        if self.histogram is not None:
+            self.draw_histograms()
         self.sel.set_image(self.sv)
 
+    def draw_histograms(self):
+        "Draws histogram overlays into `sv`, adds hue histogram strip"
+        self.histogram.draw_sv(self.sv[:self.size])
+        strip = np.empty((self.histogram_height, self.size, 3), np.uint8)
+        hues = np.int32(np.linspace(0, 179, self.size))  # see `h_comp`
+        self.histogram.draw_hue(strip, self.h_comp[0], hues)
+        self.sv = cv2.vconcat([self.sv, strip])
+
     def create_sat_br_rect(self, hue):
-        self.tpl_hsv[:, :, 0] = hue
-        return cv2.vconcat([
-            cv2.cvtColor(self.tpl_hsv, cv2.COLOR_HSV2BGR),
-            self.h_comp
-        ])
+        plane = self.plane_cache.get(hue)
+        if plane is None:
+            plane = self.render_sat_br_plane(hue)
+            self.plane_cache.put(hue, plane)
+        return cv2.vconcat([plane, self.h_comp])
+
+    @property
+    def h_comp(self) -> np.ndarray:
+        "Hue slider image, built once"
+        if self._h_comp is None:
+            h_comp = np.uint8([np.linspace([0., 255., 255.], [179., 255., 255.], self.size)])
+            h_comp = np.broadcast_to(h_comp, (self.slider_height, self.size, 3))
+            self._h_comp = cv2.cvtColor(h_comp, cv2.COLOR_HSV2BGR)
+        return self._h_comp
+
+    @property
+    def sv_product(self) -> np.ndarray:
+        "(1 - S) * V plane (uint8), the same for all hues, built once"
+        if self._sv_product is None:
+            ramp = np.float32(self.sv_ramp)
+            self._sv_product = cv2.convertScaleAbs(np.outer(1 - ramp / 255, ramp))
+        return self._sv_product
+
+    def render_sat_br_plane(self, hue, dst: np.ndarray=None) -> np.ndarray:
+        """
+        Renders saturation/brightness plane of the specified hue in BGR.
+        For a fixed hue each channel is `V * (1 - S * c)` (see
+        `hue_coefficients`), ie. `V` for c = 0, `sv_product` for c = 1 and
+        their blend with weights (1 - c, c) otherwise.
+        Matches `cvtColor(..., COLOR_HSV2BGR)` within 1.
+
+        Arguments:
+        `hue` - hue value 0-179
+        `dst` - optional preallocated (size, size, 3) uint8 output
+        """
+        v = cv2.repeat(self.sv_ramp[None], self.size, 1)
+        product = self.sv_product
+        channels = [v if c == 0 else product if c == 1 else
+                    cv2.addWeighted(v, 1 - c, product, c, 0)
+                    for c in hue_coefficients(hue)]
+        return cv2.merge(channels, dst)
+
+    def warm_plane_cache(self, background: bool=True):
+        """
+        Renders saturation/brightness planes for all hue values which are not
+        cached yet. Stops when memory budget of the cache is exhausted.
+
+        Arguments:
+        `background` - render in a daemon thread. Default is True
+
+        Returns: threading.Thread if `background` or None
+        """
+        def warm():
+            for hue in range(180):
+                if hue in self.plane_cache:
+                    continue
+                if not self.plane_cache.fits(self.size * self.size * 3):
+                    break
+                self.plane_cache.put(hue, self.render_sat_br_plane(hue))
+
+        if not background:
+            warm()
+            return
+        thread = threading.Thread(target=warm, daemon=True)
+        thread.start()
+        return thread
 
     @property
     def lower_color(self):
-        return self.hue, *self._lower_color
+        return self.snapshot.lower_color
 
     @property
     def upper_color(self):
-        return self.hue, *self._upper_color
+        return self.snapshot.upper_color
 
     def shift_hue(self, shift):
         "Returns shifted hue value, e. g. 179 (hue) + 3 (shift) gives 2"
@@ -0,0 +1,635 @@
+"""
+Masking of images with HSV ranges selected in `SliderHSV`.
+Hue ranges which wrap past 179 (eg. 170-9) are supported: `RangeMask`
+thresholds both parts with `inRange` and combines them with `bitwise_or`
+(a single hue lookup table was measured slower).
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .cv_utils import BufferPool
+from .selection import Rect
+
+
+class HSVRange(NamedTuple):
+    """
+    Represents an inclusive HSV range. Hue range wraps around if
+    `lower[0] > upper[0]`, eg. (170, 9) means 170-179 and 0-9.
+    """
+    lower: Tuple[int, int, int]
+    upper: Tuple[int, int, int]
+
+    @classmethod
+    def from_colors(cls, lower_color, upper_color, hue_width: int=0) -> "HSVRange":
+        """
+        Creates range from `lower_color` and `upper_color` of `SliderHSV`.
+
+        Arguments:
+        `lower_color`, `upper_color` - (hue, saturation, brightness) bounds
+        `hue_width` - hue is extended by `hue_width` in both directions
+        """
+        lower, upper = tuple(lower_color), tuple(upper_color)
+        if 2 * hue_width + 1 >= 180:
+            lower_hue, upper_hue = 0, 179
+        else:
+            lower_hue = (lower[0] - hue_width) % 180
+            upper_hue = (upper[0] + hue_width) % 180
+        return cls((lower_hue, *lower[1:]), (upper_hue, *upper[1:]))
+
+    @classmethod
+    def from_slider(cls, slider, hue_width: int=0) -> "HSVRange":
+        "Creates range from current state of `SliderHSV` widget"
+        snapshot = slider.snapshot
+        return cls.from_colors(snapshot.lower_color, snapshot.upper_color,
+                               hue_width)
+
+    @property
+    def wraps(self) -> bool:
+        "Hue range wraps around 179"
+        return self.lower[0] > self.upper[0]
+
+
+class RangeMask:
+    """
+    HSV range compiled into OpenCV bounds.
+
+    A wrapping hue range is split into two parts. The second part is
+    thresholded into a reusable scratch buffer and merged into `dst` in place,
+    so no intermediate masks are allocated per frame.
+    """
+
+    def __init__(self, rng: HSVRange):
+        self.range = rng
+        lower, upper = np.uint8(rng.lower), np.uint8(rng.upper)
+        if rng.wraps:
+            self.bounds = ((lower, np.uint8([179, *upper[1:]])),
+                           (np.uint8([0, *lower[1:]]), upper))
+        else:
+            self.bounds = ((lower, upper), )
+        self._scratch: Optional[np.ndarray] = None
+
+    def __call__(self, hsv: np.ndarray, dst: np.ndarray=None) -> np.ndarray:
+        """
+        Thresholds HSV image.
+
+        Arguments:
+        `hsv` - HSV image (see `cv2.COLOR_BGR2HSV`)
+        `dst` - optional preallocated output mask of `hsv.shape[:2]` size
+
+        Returns: mask (uint8, 0 or 255)
+        """
+        (lower, upper), *rest = self.bounds
+        dst = cv2.inRange(hsv, lower, upper, dst=dst)
+        for lower, upper in rest:
+            height, width = dst.shape
+            if self._scratch is None or self._scratch.shape[0] < height or \
+               self._scratch.shape[1] < width:
+                self._scratch = np.empty_like(dst)
+            # smaller images (eg. regions) use a view of the scratch buffer
+            scratch = self._scratch[:height, :width]
+            cv2.inRange(hsv, lower, upper, dst=scratch)
+            cv2.bitwise_or(dst, scratch, dst=dst)
+        return dst
+
+
+def range_mask(hsv: np.ndarray, rng: HSVRange, dst: np.ndarray=None) -> np.ndarray:
+    """
+    Thresholds HSV image with a (possibly wrapping) HSV range.
+    Use `RangeMask` to reuse compiled range between frames.
+
+    Arguments:
+    `hsv` - HSV image
+    `rng` - HSV range
+    `dst` - optional preallocated output mask
+
+    Returns: mask (uint8, 0 or 255)
+    """
+    return RangeMask(rng)(hsv, dst)
+
+
+def _percentile_bins(hist: np.ndarray, percentile: float) -> Tuple[int, int]:
+    "Returns bins of `percentile` and 100 - `percentile` of histogram values"
+    cum = np.cumsum(hist)
+    n = cum[-1]
+    return (int(np.searchsorted(cum, n * percentile / 100, 'right')),
+            int(np.searchsorted(cum, n * (100 - percentile) / 100, 'left')))
+
+
+def _hue_gap(hist: np.ndarray) -> int:
+    """
+    Returns first bin of the largest circular run of empty hue bins
+    or the least populated bin if there are no empty bins
+    """
+    empty = hist == 0
+    if not empty.any():
+        return int(np.argmin(hist))
+    edges = np.diff(np.int8([0, *empty, *empty, 0]))  # runs may wrap around
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    return int(starts[np.argmax(np.minimum(ends - starts, len(hist)))] % len(hist))
+
+
+def suggest_range(img: np.ndarray, rect: Rect=None, percentile: float=5,
+                  is_hsv: bool=False) -> HSVRange:
+    """
+    Suggests HSV range which covers colors of image region.
+    Bounds are robust percentiles computed from histograms. Hue is circular:
+    hue histogram is cut at the largest gap, so clusters around red (eg.
+    170-9) give a wrapping range.
+
+    Arguments:
+    `img` - BGR image (or HSV if `is_hsv`)
+    `rect` - region, eg. selected with `selectROI`. Default is whole image
+    `percentile` - percent of pixels which may be left out of the range
+                   on each side of each channel. Default is 5
+    `is_hsv` - `img` is already in HSV
+
+    Returns: HSVRange
+    """
+    if rect:  # view, only the region is converted
+        img = img[rect.y:rect.y + rect.h, rect.x:rect.x + rect.w]
+    hsv = img if is_hsv else cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    hue = cv2.calcHist([hsv], [0], None, [180], [0, 180]).ravel()
+    shift = _hue_gap(hue)
+    lower_hue, upper_hue = _percentile_bins(np.roll(hue, -shift), percentile)
+    if upper_hue - lower_hue >= 179:
+        lower_hue, upper_hue = 0, 179
+    else:
+        lower_hue, upper_hue = (lower_hue + shift) % 180, (upper_hue + shift) % 180
+    sat = _percentile_bins(cv2.calcHist([hsv], [1], None, [256], [0, 256]), percentile)
+    val = _percentile_bins(cv2.calcHist([hsv], [2], None, [256], [0, 256]), percentile)
+    return HSVRange((lower_hue, sat[0], val[0]), (upper_hue, sat[1], val[1]))
+
+
+class SliderMask:
+    """
+    Mask which follows range of `SliderHSV`. Range is compiled only when
+    slider version (see `SliderHSV.snapshot`) or `hue_width` changes,
+    otherwise each call costs one version check.
+
+    `slider` - SliderHSV widget, may be changed by another thread
+    `hue_width` - see `HSVRange.from_colors`
+    `compile` - function which compiles `HSVRange` to a callable
+                `(img, dst) -> mask`. Default is `RangeMask`
+
+    `rebuilds` - number of compilations
+    """
+
+    def __init__(self, slider, hue_width: int=0, compile=RangeMask):
+        self.slider = slider
+        self.hue_width = hue_width
+        self.compile = compile
+        self.rebuilds = 0
+        self._key = None
+        self._compiled = None
+
+    @property
+    def compiled(self):
+        "Compiled range of the current slider version"
+        snapshot = self.slider.snapshot
+        key = snapshot.version, self.hue_width
+        if key != self._key:
+            self._compiled = self.compile(snapshot.range(self.hue_width))
+            self._key = key
+            self.rebuilds += 1
+        return self._compiled
+
+    def __call__(self, img: np.ndarray, dst: np.ndarray=None) -> np.ndarray:
+        return self.compiled(img, dst)
+
+
+class FrameMasker:
+    """
+    Converts BGR frames to HSV, thresholds and masks them into buffers of
+    a `BufferPool`, so no arrays are allocated per frame in steady state.
+    Outputs of the previous `pool.depth - 1` frames stay valid.
+    Pooling mostly saves peak memory, the speedup over the allocating loop
+    (`benchmarks.py pooled_mask`) comes from masking with `copyTo`.
+
+    Arguments:
+    `mask` - HSV range or compiled mask, eg. `RangeMask`, `SliderMask`,
+             called as `mask(hsv, dst)`
+    `pool` - buffer pool. Default is a new pool of depth 2
+    """
+
+    def __init__(self, mask, pool: BufferPool=None):
+        self.mask = RangeMask(mask) if isinstance(mask, HSVRange) else mask
+        self.pool = pool or BufferPool()
+
+    def __call__(self, bgr: np.ndarray, masked: bool=True
+                 ) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        Masks BGR frame.
+
+        Arguments:
+        `bgr` - BGR frame
+        `masked` - compute masked image, zero outside the mask
+
+        Returns: HSV image, mask, masked image or None
+        """
+        hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV, dst=self.pool.like('hsv', bgr))
+        mask = self.mask(hsv, self.pool.get('mask', bgr.shape[:2]))
+        if not masked:
+            return hsv, mask, None
+        dst = self.pool.like('masked', bgr)
+        dst[:] = 0  # `copyTo` skips pixels outside the mask
+        # same result as masked `bitwise_and(bgr, bgr)` at about half the cost
+        return hsv, mask, cv2.copyTo(bgr, mask, dst)
+
+
+class ColorClassifier:
+    """
+    Labels pixels of HSV image with named HSV ranges in a single pass.
+
+    Ranges are compiled into per-channel lookup tables of class bits
+    (8 classes per group), so the cost depends on the number of groups rather
+    than the number of classes. Labels are 1-based indices of classes in
+    order of `add`, 0 - no class matched. Overlapping ranges are resolved by
+    priority: the class added first wins.
+
+    `ranges` - optional dict of class names and ranges
+    """
+    group_size = 8
+
+    def __init__(self, ranges: Dict[str, HSVRange]=None):
+        self.ranges: Dict[str, HSVRange] = {}
+        self._groups: Optional[List[Tuple[np.ndarray, np.ndarray]]] = None
+        self._buffers: Dict[str, np.ndarray] = {}
+        for name, rng in (ranges or {}).items():
+            self.add(name, rng)
+
+    @property
+    def names(self) -> List[str]:
+        "Class names, label `i` is `names[i - 1]`"
+        return list(self.ranges)
+
+    def add(self, name: str, rng: HSVRange):
+        if name not in self.ranges and len(self.ranges) >= 255:
+            raise ValueError("Too many classes, max is 255")
+        self.ranges[name] = rng
+        self._groups = None
+
+    def add_slider(self, name: str, slider, hue_width: int=0):
+        "Adds range of current state of `SliderHSV` widget"
+        self.add(name, HSVRange.from_slider(slider, hue_width))
+
+    def compile(self) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns list of (channel bits LUTs (3x256), label LUT (256)) groups,
+        compiled tables are cached until a class is added
+        """
+        if self._groups is None:
+            self._groups = []
+            ranges = list(self.ranges.values())
+            for first in range(0, len(ranges), self.group_size):
+                bits = np.zeros((3, 256), np.uint8)
+                for i, rng in enumerate(ranges[first:first + self.group_size]):
+                    for ch, values in enumerate(channel_sets(rng)):
+                        bits[ch, :len(values)][values] |= 1 << i
+                # lowest set bit has the highest priority
+                masks = np.arange(256)
+                lowest = np.log2(masks & -masks, where=masks > 0,
+                                 out=np.full(256, -1.)).astype(int)
+                labels = np.where(masks > 0, first + 1 + lowest, 0).astype(np.uint8)
+                self._groups.append((bits, labels))
+        return self._groups
+
+    def _buffer(self, name: str, shape) -> np.ndarray:
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = self._buffers[name] = np.empty(shape, np.uint8)
+        return buf
+
+    def labels(self, hsv: np.ndarray, dst: np.ndarray=None) -> np.ndarray:
+        """
+        Labels pixels of HSV image.
+
+        Arguments:
+        `hsv` - HSV image
+        `dst` - optional preallocated output label map of `hsv.shape[:2]` size
+
+        Returns: label map (uint8)
+        """
+        shape = hsv.shape[:2]
+        if dst is None:
+            dst = np.empty(shape, np.uint8)
+        groups = self.compile()
+        if not groups:
+            dst[:] = 0
+            return dst
+        channels = [self._buffer(f"ch{i}", shape) for i in range(3)]
+        cv2.split(hsv, channels)
+        bits = [self._buffer(f"bits{i}", shape) for i in range(3)]
+        group_labels = self._buffer("labels", shape)
+        # lower priority groups first, so higher priority labels overwrite them
+        for i, (channel_bits, label_lut) in enumerate(reversed(groups)):
+            for ch in range(3):
+                cv2.LUT(channels[ch], channel_bits[ch], dst=bits[ch])
+            cv2.bitwise_and(bits[0], bits[1], dst=bits[0])
+            cv2.bitwise_and(bits[0], bits[2], dst=bits[0])
+            if i == 0:
+                cv2.LUT(bits[0], label_lut, dst=dst)
+            else:
+                cv2.LUT(bits[0], label_lut, dst=group_labels)
+                cv2.copyTo(group_labels, group_labels, dst)
+        return dst
+
+    def counts(self, hsv: np.ndarray) -> Dict[str, int]:
+        "Returns number of pixels of each class"
+        labels = self.labels(hsv, self._buffer("counts", hsv.shape[:2]))
+        hist = cv2.calcHist([labels], [0], None, [256], [0, 256]).ravel()
+        return {name: int(hist[i + 1]) for i, name in enumerate(self.ranges)}
+
+
+class TiledMasker:
+    """
+    Converts BGR frames to HSV, thresholds and masks them in horizontal strips
+    on a thread pool. OpenCV releases the GIL, so strips are processed on
+    multiple cores. Each strip writes straight into shared output buffers,
+    there's no stitching copy.
+
+    NOTE: OpenCV parallelizes some functions internally too, consider
+          `cv2.setNumThreads(1)` if the pool oversubscribes cores
+
+    Arguments:
+    `rng` - HSV range
+    `threads` - thread pool size. Default is `os.cpu_count()`
+    `strips` - number of strips a frame is split into, at most one per row.
+               Default is `threads`
+    """
+
+    def __init__(self, rng: HSVRange, threads: int=None, strips: int=None):
+        self.threads = threads or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(self.threads)
+        self.strips = strips or self.threads
+        self.set_range(rng)
+        self._hsv: Optional[np.ndarray] = None
+
+    def set_range(self, rng: HSVRange):
+        self.range = rng
+        # `RangeMask` has scratch buffer, so each strip gets its own instance
+        self._masks = [RangeMask(rng) for _ in range(self.strips)]
+
+    def __call__(self, bgr: np.ndarray, mask: np.ndarray=None,
+                 masked: np.ndarray=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Thresholds BGR frame.
+
+        Arguments:
+        `bgr` - BGR frame
+        `mask` - optional preallocated output mask of `bgr.shape[:2]` size
+        `masked` - optional preallocated output image of `bgr.shape` size
+
+        Returns: mask, masked image (see `cv2.bitwise_and`)
+        """
+        height = bgr.shape[0]
+        strips = min(self.strips, height)  # strips aren't empty
+        if self._hsv is None or self._hsv.shape != bgr.shape:
+            self._hsv = np.empty_like(bgr)
+        if mask is None:
+            mask = np.empty(bgr.shape[:2], np.uint8)
+        if masked is None:
+            masked = np.empty_like(bgr)
+
+        def process(i):
+            rows = slice(height * i // strips, height * (i + 1) // strips)
+            src, hsv = bgr[rows], self._hsv[rows]
+            cv2.cvtColor(src, cv2.COLOR_BGR2HSV, dst=hsv)
+            self._masks[i](hsv, dst=mask[rows])
+            masked[rows] = 0  # `bitwise_and` skips pixels outside the mask
+            cv2.bitwise_and(src, src, dst=masked[rows], mask=mask[rows])
+
+        for future in [self.executor.submit(process, i) for i in range(strips)]:
+            future.result()
+        return mask, masked
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ROIMasker:
+    """
+    Converts and thresholds only regions of interest of BGR frames, eg. the
+    selection of `RectSelection`. Regions are processed through views of the
+    frame and the output, so work is proportional to the area of regions.
+
+    Arguments:
+    `mask` - HSV range or compiled mask, eg. `RangeMask` or `SliderMask`,
+             called as `mask(hsv, dst)`
+    `rects` - Rect, (x, y, w, h) or a list of them, see `set_rects`
+    `output` - 'full' - frame-size mask, zero outside regions;
+               'roi' - list of region-size masks
+    `convert` - color conversion of regions before masking. Default is
+                `cv2.COLOR_BGR2HSV`, None - frames are already HSV
+    """
+    max_cleared = 8  # number of output masks remembered as cleared
+
+    def __init__(self, mask, rects, output: str='full',
+                 convert: Optional[int]=cv2.COLOR_BGR2HSV):
+        if output not in ('full', 'roi'):
+            raise ValueError(f"unknown output: {output}")
+        self.mask = RangeMask(mask) if isinstance(mask, HSVRange) else mask
+        self.output = output
+        self.convert = convert
+        self._hsv: List[np.ndarray] = []  # converted regions
+        self._rois: List[np.ndarray] = []  # region masks of 'roi' output
+        self._full: Optional[np.ndarray] = None  # default frame-size mask
+        self._cleared: List[np.ndarray] = []  # masks cleared outside regions
+        self.set_rects(rects)
+
+    def set_rects(self, rects):
+        "Sets regions: Rect, (x, y, w, h) or a list of them"
+        if isinstance(rects, Rect) or (len(rects) == 4 and
+                                       np.isscalar(rects[0])):
+            rects = [rects]
+        self.rects = [rc if isinstance(rc, Rect) else Rect(*map(int, rc))
+                      for rc in rects]
+        self._cleared = []  # areas of previous regions aren't cleared
+
+    def clipped_rects(self, shape: Tuple[int, ...]) -> List[Rect]:
+        "Returns regions clipped by frame bounds (empty if outside)"
+        bounds = Rect(0, 0, shape[1], shape[0])
+        return [rc.intersection(bounds) for rc in self.rects]
+
+    @staticmethod
+    def _buffer(buffers: List[np.ndarray], i: int, shape, dtype=np.uint8) -> np.ndarray:
+        while len(buffers) <= i:
+            buffers.append(np.empty(0, dtype))
+        if buffers[i].shape != shape:
+            buffers[i] = np.empty(shape, dtype)
+        return buffers[i]
+
+    def __call__(self, bgr: np.ndarray, dst=None):
+        """
+        Thresholds regions of BGR frame.
+
+        Arguments:
+        `bgr` - BGR frame
+        `dst` - optional preallocated output: frame-size mask ('full' output),
+                list of region-size masks ('roi' output). Outside of regions
+                a frame-size mask is cleared only when one of the last
+                `max_cleared` masks isn't passed or regions have changed
+
+        Returns: mask (uint8, 0 or 255) or list of masks. If `dst` isn't
+        specified the mask (masks) is reused by the next call
+        """
+        rects = self.clipped_rects(bgr.shape)
+        if self.output == 'full':
+            if dst is None:
+                if self._full is None or self._full.shape != bgr.shape[:2]:
+                    self._full = np.empty(bgr.shape[:2], np.uint8)
+                dst = self._full
+            if not any(dst is mask for mask in self._cleared):
+                dst[:] = 0
+                self._cleared = [dst, *self._cleared[:self.max_cleared - 1]]
+            outputs = [dst[rc.y:rc.y + rc.h, rc.x:rc.x + rc.w] for rc in rects]
+        else:
+            outputs = dst if dst is not None else \
+                      [self._buffer(self._rois, i, (rc.h, rc.w))
+                       for i, rc in enumerate(rects)]
+        for i, (rc, out) in enumerate(zip(rects, outputs)):
+            if not rc:
+                continue
+            roi = bgr[rc.y:rc.y + rc.h, rc.x:rc.x + rc.w]  # view, not a copy
+            if self.convert is not None:
+                roi = cv2.cvtColor(roi, self.convert,
+                                   dst=self._buffer(self._hsv, i, roi.shape))
+            self.mask(roi, out)
+        return dst if self.output == 'full' else outputs
+
+
+class IncrementalMasker:
+    """
+    Masks frames of a static camera incrementally. Frames are split into
+    blocks, only blocks which changed since they were masked last time are
+    converted and thresholded again, the previous mask is kept elsewhere.
+    A block is changed if any channel of any pixel differs by more than
+    `threshold` (raise it for noisy cameras). Changed blocks of a block row
+    are processed in runs through views.
+
+    Everything is masked again when the range changes (`mask.range` or
+    `mask.compiled.range` of `SliderMask`) or frame size changes, see also
+    `invalidate`.
+
+    Arguments:
+    `mask` - HSV range or compiled mask, eg. `RangeMask` or `SliderMask`,
+             called as `mask(hsv, dst)`
+    `block` - block size in px. Default is 32
+    `threshold` - max difference of unchanged pixel channels. Default is 8
+    `convert` - color conversion before masking. Default is
+                `cv2.COLOR_BGR2HSV`, None - frames are already HSV
+
+    `last_skipped` - fraction of blocks skipped in the last frame,
+    `blocks`, `skipped` - number of blocks processed or skipped in all frames
+    """
+
+    def __init__(self, mask, block: int=32, threshold: int=8,
+                 convert: Optional[int]=cv2.COLOR_BGR2HSV):
+        self.mask = RangeMask(mask) if isinstance(mask, HSVRange) else mask
+        self.block = block
+        self.threshold = threshold
+        self.convert = convert
+        self.last_skipped = 0.
+        self.blocks = 0
+        self.skipped = 0
+        self._key = None
+        self._ref: Optional[np.ndarray] = None  # pixels blocks were masked from
+        self._hsv: Optional[np.ndarray] = None
+        self._mask: Optional[np.ndarray] = None
+        self._diff: Optional[np.ndarray] = None  # padded to whole blocks
+
+    @property
+    def skip_fraction(self) -> float:
+        "Fraction of blocks skipped in all frames"
+        return self.skipped / max(self.blocks + self.skipped, 1)
+
+    def invalidate(self):
+        "Masks the next frame entirely"
+        self._key = None
+
+    def _range(self):
+        compiled = getattr(self.mask, 'compiled', self.mask)
+        return getattr(compiled, 'range', None)
+
+    def _process(self, bgr: np.ndarray, rows: slice, cols: slice):
+        src, mask = bgr[rows, cols], self._mask[rows, cols]
+        if self.convert is not None:
+            hsv = self._hsv[rows, cols]
+            cv2.cvtColor(src, self.convert, dst=hsv)
+            self.mask(hsv, mask)
+        else:
+            self.mask(src, mask)
+        self._ref[rows, cols] = src
+
+    def changed_blocks(self, bgr: np.ndarray) -> np.ndarray:
+        "Returns (block rows, block columns) bool array of changed blocks"
+        height, width = bgr.shape[:2]
+        b = self.block
+        diff = self._diff
+        cv2.absdiff(bgr, self._ref, dst=diff[:height, :width])
+        rows, cols = diff.shape[0] // b, diff.shape[1] // b
+        # max of block rows, then of blocks (contiguous reductions)
+        row_max = diff.reshape(rows, b, -1).max(axis=1)
+        return row_max.reshape(rows, cols, -1).max(axis=2) > self.threshold
+
+    def __call__(self, bgr: np.ndarray, dst: np.ndarray=None) -> np.ndarray:
+        """
+        Thresholds BGR frame.
+
+        Arguments:
+        `bgr` - BGR frame
+        `dst` - optional output mask, the mask is copied into it
+
+        Returns: mask (uint8, 0 or 255). If `dst` isn't specified it's
+        updated in place by the next call
+        """
+        height, width = bgr.shape[:2]
+        b = self.block
+        key = bgr.shape, self._range()
+        if key != self._key:
+            self._ref = bgr.copy()
+            self._hsv = np.empty_like(bgr)
+            self._mask = np.empty((height, width), np.uint8)
+            self._diff = np.zeros((-(-height // b) * b, -(-width // b) * b,
+                                   *bgr.shape[2:]), np.uint8)
+            self._process(bgr, slice(None), slice(None))
+            self._key = key
+            n, skipped = self._diff.shape[0] // b * (self._diff.shape[1] // b), 0
+        else:
+            changed = self.changed_blocks(bgr)
+            n, skipped = changed.size, changed.size - int(np.count_nonzero(changed))
+            for row in np.flatnonzero(changed.any(axis=1)):
+                # runs of changed blocks: starts at +1 edges, ends at -1 edges
+                edges = np.diff(np.int8([0, *changed[row], 0]))
+                rows = slice(row * b, (row + 1) * b)
+                for start, end in zip(np.flatnonzero(edges == 1),
+                                      np.flatnonzero(edges == -1)):
+                    self._process(bgr, rows, slice(start * b, end * b))
+        self.blocks += n - skipped
+        self.skipped += skipped
+        self.last_skipped = skipped / n
+        if dst is None:
+            return self._mask
+        np.copyto(dst, self._mask)
+        return dst
+
+
+def channel_sets(rng: HSVRange) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    "Returns boolean membership arrays of hue (180), saturation and value (256)"
+    sets = np.zeros(180, bool), np.zeros(256, bool), np.zeros(256, bool)
+    for values, lower, upper in zip(sets, rng.lower, rng.upper):
+        if lower > upper:  # hue wraps around
+            values[lower:] = values[:upper + 1] = True
+        else:
+            values[lower:upper + 1] = True
+    return sets
+
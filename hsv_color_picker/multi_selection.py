@@ -0,0 +1,193 @@
+"""
+Selection of many rectangles on an image, see `MultiRectSelection`
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+
+from .selection import Rect, RectSelection
+
+
+class GridIndex:
+    """
+    Uniform grid index of rectangles. Each rect is registered in all cells
+    it touches, so point and rect queries only look at touched cells.
+
+    `cell` - cell size in px. Default is 64
+    """
+
+    def __init__(self, cell: int=64):
+        self.cell = cell
+        self.cells: Dict[Tuple[int, int], Set[int]] = defaultdict(set)
+        self.bounds: Dict[int, Rect] = {}
+
+    def __len__(self) -> int:
+        return len(self.bounds)
+
+    def _cells(self, rc: Rect) -> Iterable[Tuple[int, int]]:
+        c = self.cell
+        for cy in range(rc.y // c, (rc.y + rc.h - 1) // c + 1):
+            for cx in range(rc.x // c, (rc.x + rc.w - 1) // c + 1):
+                yield cx, cy
+
+    def insert(self, key: int, rc: Rect):
+        self.bounds[key] = rc
+        for cell in self._cells(rc):
+            self.cells[cell].add(key)
+
+    def remove(self, key: int):
+        for cell in self._cells(self.bounds.pop(key)):
+            keys = self.cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    def update(self, key: int, rc: Rect):
+        if key in self.bounds:
+            self.remove(key)
+        self.insert(key, rc)
+
+    def clear(self):
+        self.cells.clear()
+        self.bounds.clear()
+
+    def query_point(self, x: int, y: int) -> Set[int]:
+        "Returns keys of rects which may contain the point (same cell)"
+        return self.cells.get((x // self.cell, y // self.cell), set())
+
+    def query(self, rc: Rect) -> Set[int]:
+        "Returns keys of rects which intersect `rc`"
+        ret = set()
+        for cell in self._cells(rc):
+            ret.update(self.cells.get(cell, ()))
+        return {key for key in ret if self.bounds[key].intersection(rc)}
+
+
+class MultiRectSelection(RectSelection):
+    """
+    Selection of many rectangles. Rectangle under the cursor becomes active
+    and is moved or resized like the selection of `RectSelection`, drag
+    outside of all rects adds a new one. Rects are hit-tested with
+    `GridIndex`, only rects which touch the redrawn area are drawn again.
+
+    `rects` - initial rects, see `from_array`
+    `cell` - cell size of the index in px. Default is 64
+    See `RectSelection` for other arguments.
+
+    `selection` - active rect, `active` - its index in `rects`
+    """
+    clr_passive = (0, 255, 255)
+    _stale = object()  # cursor area which differs from any area
+
+    def __init__(self, window_name: str, img: np.ndarray, rect=None,
+                 rects: np.ndarray=None, cell: int=64, **kwargs):
+        self.rects: List[Rect] = []
+        self.active: Optional[int] = None
+        self.index = GridIndex(cell)
+        super().__init__(window_name, img, rect, **kwargs)
+        if rects is not None:
+            self.from_array(rects)
+
+    @property
+    def _margin(self) -> int:
+        "Rects are indexed with the margin touched by cursor and overlay"
+        return max(self.cursor_tolerance, self.overlay_margin)
+
+    def _index_rect(self, i: int):
+        m, rc = self._margin, self.rects[i]
+        self.index.update(i, Rect(rc.x - m, rc.y - m, rc.w + 2 * m, rc.h + 2 * m))
+
+    def hit_test(self, x: int, y: int) -> Optional[int]:
+        "Returns index of the topmost (last added) rect under the cursor or None"
+        for i in sorted(self.index.query_point(x, y), reverse=True):
+            if self.get_cursor_area(x, y, self.rects[i]):
+                return i
+        return None
+
+    def activate(self, i: Optional[int]):
+        "Makes rect `i` the selection (None - no active rect)"
+        if i == self.active:
+            return
+        for rc in (self.sel_rc, self.rects[i] if i is not None else Rect()):
+            # repaint area of the rect which changes style
+            area = self._image_area(rc, self.overlay_margin)
+            if self._dirty is not None:
+                self._dirty = self._dirty.union(area)
+        self.active = i
+        self.sel_rc = self.rects[i] if i is not None else Rect()
+        self._last_cursor_area = self._stale  # forced update
+
+    def on_mouse_event(self, event, x: int, y: int, flags, param) -> Optional[bool]:
+        if event == cv2.EVENT_LBUTTONDOWN or \
+           (event == cv2.EVENT_MOUSEMOVE and not self.moving):
+            self.activate(self.hit_test(x, y))
+        return super().on_mouse_event(event, x, y, flags, param)
+
+    def set_selection(self, rc: Rect):
+        if not rc:
+            return
+        if self.active is None:
+            self.rects.append(rc)
+            self.active = len(self.rects) - 1
+        else:
+            self.rects[self.active] = rc
+        self._index_rect(self.active)
+        super().set_selection(rc)
+
+    def remove(self, i: int):
+        "Removes rect `i`"
+        rc = self.rects.pop(i)
+        if self.active == i:
+            self.active, self.sel_rc = None, Rect()
+        elif self.active is not None and self.active > i:
+            self.active -= 1
+        self._reindex()
+        self._dirty = None if self._dirty is None else \
+            self._dirty.union(self._image_area(rc, self.overlay_margin))
+        self.request_draw(self.sel_rc)
+
+    def _reindex(self):
+        self.index.clear()
+        for i in range(len(self.rects)):
+            self._index_rect(i)
+
+    def from_array(self, rects: np.ndarray):
+        "Replaces all rects with (n, 4) array of x, y, w, h"
+        self.rects = [Rect(*map(int, row)) for row in np.asarray(rects).reshape(-1, 4)]
+        self.active, self.sel_rc = None, Rect()
+        self._reindex()
+        self._dirty = None  # full redraw
+        self.request_draw(self.sel_rc)
+
+    def to_array(self) -> np.ndarray:
+        "Returns all rects as (n, 4) int32 array of x, y, w, h"
+        return np.array([(rc.x, rc.y, rc.w, rc.h) for rc in self.rects],
+                        np.int32).reshape(-1, 4)
+
+    def draw_rect(self, rc: Rect, hilight=None):
+        if rc:
+            super().draw_rect(rc, hilight)
+        else:  # no active rect, only inactive ones are displayed
+            self.backend.show(self.wnd, self._restore_display())
+
+    def draw_passive(self, img: np.ndarray, rc: Rect):
+        "Draws rect which isn't active"
+        tl, _, br, _ = rc.points
+        cv2.rectangle(img, tl, br, self.clr_passive)
+
+    def _restore_display(self) -> np.ndarray:
+        "Restores modified area and redraws inactive rects which touch it"
+        dirty = self._dirty
+        img = super()._restore_display()
+        if dirty is None:
+            keys = range(len(self.rects))
+        elif dirty:
+            keys = sorted(self.index.query(dirty))
+        else:
+            keys = ()
+        for i in keys:
+            if i != self.active:
+                self.draw_passive(img, self.rects[i])
+        return img
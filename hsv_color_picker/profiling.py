@@ -0,0 +1,161 @@
+"""
+Opt-in profiling of widget callbacks.
+
+Entry points (mouse callbacks, drawing, `put_text_block`, display) are
+decorated with `profiled`. While profiling is disabled the decorator costs
+one global lookup per call. `enable` starts recording calls into a
+`Profiler`, which reports summary statistics (`Profiler.stats`) and writes
+Chrome trace-event JSON (`Profiler.dump_trace`), viewable in
+chrome://tracing or https://ui.perfetto.dev
+
+    profiler = profiling.enable()
+    ...  # interact with the widgets
+    print(profiler.format_stats())
+    profiler.dump_trace("trace.json")
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Callable, Deque, Dict, Hashable, List, NamedTuple, Optional
+
+import numpy as np
+
+
+class Span(NamedTuple):
+    name: str
+    start: float  # perf_counter seconds
+    end: float
+    thread: int
+
+
+class Profiler:
+    """
+    Records calls of `profiled` functions.
+
+    `max_spans` - number of last calls kept for the trace. Statistics
+                  include all calls
+
+    `counts` - number of calls of each entry point
+    `frames` - intervals between frames of each window in seconds
+    """
+
+    def __init__(self, max_spans: int=100000):
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+        self.frames: Dict[Hashable, List[float]] = defaultdict(list)
+        self._last_frame: Dict[Hashable, float] = {}
+        self._start = time.perf_counter()
+
+    def record(self, name: str, start: float, end: float):
+        "Records call of `name` which took from `start` to `end` (perf_counter)"
+        self.spans.append(Span(name, start, end, threading.get_ident()))
+        self.counts[name] += 1
+        self.durations[name].append(end - start)
+
+    def frame(self, key: Hashable, t: float):
+        "Records frame shown in the window `key` at `t` (perf_counter)"
+        last = self._last_frame.get(key)
+        if last is not None:
+            self.frames[key].append(t - last)
+        self._last_frame[key] = t
+
+    def reset(self):
+        self.spans.clear()
+        self.counts.clear()
+        self.durations.clear()
+        self.frames.clear()
+        self._last_frame.clear()
+        self._start = time.perf_counter()
+
+    @staticmethod
+    def _summary(seconds: List[float]) -> Dict[str, float]:
+        ms = np.array(seconds) * 1000
+        p50, p90, p99 = np.percentile(ms, (50, 90, 99))
+        return {'count': len(ms), 'total_ms': ms.sum(), 'mean_ms': ms.mean(),
+                'p50_ms': p50, 'p90_ms': p90, 'p99_ms': p99, 'max_ms': ms.max()}
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns dict of statistics of each entry point: `count`, `total_ms`,
+        `mean_ms`, `p50_ms`, `p90_ms`, `p99_ms`, `max_ms`.
+        Frame-to-frame latency of each window is reported as `frame <window>`
+        """
+        ret = {name: self._summary(d) for name, d in self.durations.items()}
+        ret.update((f"frame {key}", self._summary(d))
+                   for key, d in self.frames.items() if d)
+        return ret
+
+    def format_stats(self) -> str:
+        "Returns statistics as a table sorted by total time"
+        rows = sorted(self.stats().items(), key=lambda i: -i[1]['total_ms'])
+        lines = [f"{'':<24}{'count':>8}{'total ms':>10}{'mean':>8}"
+                 f"{'p50':>8}{'p90':>8}{'max':>8}"]
+        lines += [f"{name:<24}{s['count']:>8}{s['total_ms']:>10.1f}"
+                  f"{s['mean_ms']:>8.2f}{s['p50_ms']:>8.2f}{s['p90_ms']:>8.2f}"
+                  f"{s['max_ms']:>8.2f}" for name, s in rows]
+        return '\n'.join(lines)
+
+    def trace_events(self) -> List[dict]:
+        "Returns recorded calls as Chrome trace events (complete events)"
+        pid = os.getpid()
+        return [{'name': s.name, 'cat': 'callback', 'ph': 'X', 'pid': pid,
+                 'tid': s.thread, 'ts': (s.start - self._start) * 1e6,
+                 'dur': (s.end - s.start) * 1e6} for s in self.spans]
+
+    def dump_trace(self, path: str):
+        "Writes Chrome trace-event JSON file"
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(),
+                       'displayTimeUnit': 'ms'}, f)
+
+
+_profiler: Optional[Profiler] = None
+
+
+def enable(profiler: Profiler=None) -> Profiler:
+    "Starts recording of `profiled` calls, returns the profiler"
+    global _profiler
+    _profiler = profiler or _profiler or Profiler()
+    return _profiler
+
+
+def disable() -> Optional[Profiler]:
+    "Stops recording, returns the profiler with recorded calls"
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def get_profiler() -> Optional[Profiler]:
+    "Returns the active profiler or None if profiling is disabled"
+    return _profiler
+
+
+def profiled(name: str, frame: Callable[..., Hashable]=None):
+    """
+    Decorator which records calls of the function while profiling is enabled.
+
+    `name` - entry point name in statistics and trace
+    `frame` - function of the call arguments which returns a window,
+              calls are recorded as frames of the window
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _profiler
+            if profiler is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                profiler.record(name, start, end)
+                if frame is not None:
+                    profiler.frame(frame(*args, **kwargs), end)
+        return wrapper
+    return decorator
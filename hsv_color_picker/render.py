@@ -0,0 +1,65 @@
+"""
+Coalesced rendering of widgets, see `RenderScheduler`
+"""
+import time
+from typing import Callable, Dict, Hashable
+
+from .display import get_backend
+
+
+class RenderScheduler:
+    """
+    Coalesces redraw requests of widgets. Mouse callbacks only update state
+    and request a redraw, the latest request of each widget is rendered
+    once per `wait_key` call (or `flush`).
+
+    `max_fps` - if specified requests are also rendered right in the mouse
+                callback but not more often than `max_fps` times per second.
+                Default is None - render on `wait_key` only
+    `backend` - display backend used by `wait_key`,
+                default is `display.get_backend()`
+
+    `requested`, `rendered` - redraw counters
+    """
+
+    def __init__(self, max_fps: float=None, backend=None):
+        self.max_fps = max_fps
+        self.backend = backend
+        self.requested = 0
+        self.rendered = 0
+        self._pending: Dict[Hashable, Callable[[], None]] = {}
+        self._last_render = 0.
+
+    def request(self, key: Hashable, render: Callable[[], None]):
+        """
+        Requests a redraw. Previous pending request with the same `key`
+        (usually a widget) is dropped.
+        """
+        self._pending.pop(key, None)  # latest request is rendered last
+        self._pending[key] = render
+        self.requested += 1
+        if self.max_fps:
+            self.flush()
+
+    def flush(self) -> bool:
+        """
+        Renders pending requests if `max_fps` allows it.
+
+        Returns: True if something was rendered
+        """
+        if not self._pending:
+            return False
+        now = time.perf_counter()
+        if self.max_fps and now - self._last_render < 1 / self.max_fps:
+            return False
+        self._last_render = now
+        pending, self._pending = self._pending, {}
+        for render in pending.values():
+            render()
+            self.rendered += 1
+        return True
+
+    def wait_key(self, delay: int=0) -> int:
+        "Renders pending requests, then waits for a key press (`cv2.waitKey`)"
+        self.flush()
+        return (self.backend or get_backend()).wait_key(delay)
@@ -1,215 +1,83 @@
 """
 see also selectROI
 """
-from dataclasses import dataclass, astuple
-from enum import Flag, auto
-from typing import Optional, Tuple, NamedTuple, Union, Callable
+import time
+from dataclasses import astuple
+from typing import Dict, Optional, Tuple, Union, Callable
 
 import cv2
 import numpy as np
 
+from .display import get_backend
+# geometry is re-exported, it's imported from here by existing code
+from .geometry import (Point, Rect, RectElement, Vector, _cursor_areas,
+                       transformed_rect)
+from .profiling import profiled
+from .render import RenderScheduler
 
-# 3.6+ https://www.geeksforgeeks.org/typing-namedtuple-improved-namedtuples/
-class Point(NamedTuple):
-    "Represents a point. Values can be accessed as .x, .y or by indexing (x=0, y=1)"
-    x: int = 0
-    y: int = 0
 
-    def __add__(self, other: "Point") -> "Vector":
-        return Vector(self.x + other.x, self.y + other.y)
-
-    def __sub__(self, other: "Point") -> "Vector":
-        return Vector(self.x - other.x, self.y - other.y)
-
-
-class Vector(Point):
-    "Vector is used in translation operations"
-
-    @property
-    def proj_y(self):
-        "Projection on Y axis"
-        return Vector(y=self.y)
-
-    @property
-    def proj_x(self):
-        "Projection on X axis"
-        return Vector(x=self.x)
-
-    @property
-    def neg_x(self):
-        "Set X to -X"
-        return Vector(-self.x, self.y)
-
-    @property
-    def neg_y(self):
-        "Set Y to -Y"
-        return Vector(self.x, -self.y)
-
-    def __mul__(self, coef: float):
-        # multiply coordinates by coefficient
-        return Vector(round(self.x * coef), round(self.y * coef))
-
-    def __eq__(self, other: "Vector") -> bool:
-        return self.x == other.x and self.y == other.y
-
-
-# 3.7+ https://jerrynsh.com/all-you-need-to-know-about-data-classes-in-python/
-@dataclass
-class Rect:
+class RectSelection:
     """
-    Represents a rectangle.
-    `points` (prop.) - get coordinates of each corner as a tuple of Points
+    Allows to select a rectangle on the image with the mouse cursor.
+
+    Display is redrawn incrementally: only the area covered by the previous
+    overlay (and the area reported by `draw_callback`) is restored from the
+    image. Call `set_image` if the image is modified in place.
+    If `scheduler` (see `render.RenderScheduler`) is specified mouse events
+    only request redraws, selection callbacks are still called immediately.
+    `backend` - display backend, default is `display.get_backend()`
+    `progressive` - while the selection is dragged `draw_callback` receives
+                    a downscaled read-only image (not displayed, drawing on
+                    it raises an error)
+                    and the rect scaled to it, `selection_callback` receives
+                    full-resolution selection on mouse button up.
+                    Downscale factor (`preview_scale`) is adapted so that
+                    the callback takes about `preview_ms` milliseconds
     """
-    x: int = 0
-    y: int = 0
-    w: int = 0
-    h: int = 0
-
-    @property
-    def points(self) -> Tuple[Point, Point, Point, Point]:
-        """
-        Return coordinates of top-left, top-right, bottom-right and bottom-left corners as Points
-        """
-        x, y, w, h = astuple(self)
-        return Point(x, y), Point(x + w - 1, y), \
-               Point(x + w - 1, y + h - 1), Point(x, y + h - 1)
-
-    def __rshift__(self, other: Vector) -> "Rect":
-        "Translate"
-        return Rect(self.x + other.x, self.y + other.y, self.w, self.h)
-
-    def __lshift__(self, other: Vector) -> "Rect":
-        "Translate"
-        return Rect(self.x - other.x, self.y - other.y, self.w, self.h)
-
-    def __add__(self, other: Vector) -> "Rect":
-        "Resize"
-        return Rect(self.x, self.y, self.w + other.x, self.h + other.y)
-
-    def __sub__(self, other: Vector) -> "Rect":
-        "Resize"
-        return Rect(self.x, self.y, self.w - other.x, self.h - other.y)
-    
-    def __bool__(self) -> bool:
-        return self.w != 0 and self.h != 0
-
-    def normalize(self):
-        """
-        Flip coordinates if width or height is zero or negative.
-
-        NOTE: Valid rectangle cannot have zero size, eg.
-        - If `w==1` and we move right side 1px to the left, `w` becomes 0.
-        - This means that we need to move left `x` 1px to the left
-        - Now `w` becomes 2 'cause left and right sides are on adjacent pixels
-        """
-        if self.w <= 0:
-            self.x += self.w - 1
-            self.w = -self.w + 2
-        if self.h <= 0:
-            self.y += self.h - 1
-            self.h = -self.h + 2
-
-
-# https://docs.python.org/3/library/enum.html#flag
-class RectElement(Flag):
-    left = auto()    # sides
-    top = auto()     #
-    right = auto()   #
-    bottom = auto()  #
-    topleft, topright = top | left, top | right  # top corners
-    bottomright, bottomleft = bottom | right, bottom | left  # bottom corners
-    area = auto()  # inner area
-    from_center = auto()
-    # TODO: point element for point selection and moving
-
-
-class RectSelection:
     clr_white = (255, 255, 255)
     cursor_tolerance = 3
+    overlay_margin = 5  # px around rect which can be touched by the overlay
+    max_preview_scale = 16
 
     def __init__(self, window_name: str, img: np.ndarray,
                  rect: Union[Tuple[int, int, int, int], Rect]=None,
                  show_crosshair: bool=False, from_center: bool=False,
-                 draw_callback: Callable[[Rect, np.ndarray], None]=None,
-                 selection_callback: Callable[[Rect], None]=None):
+                 draw_callback: Callable[[Rect, np.ndarray], Optional[Rect]]=None,
+                 selection_callback: Callable[[Rect], None]=None,
+                 scheduler: RenderScheduler=None, backend=None,
+                 progressive: bool=False, preview_ms: float=16):
         self.moving: Optional[RectElement] = None
         self._last_cursor_area: Optional[RectElement] = None
         self.show_crosshair = show_crosshair
         self.from_center = from_center
-        self.draw_callback = lambda rc, img: None
+        self.draw_callback = lambda rc, img: Rect()
         self.selection_callback = lambda rc: None
         self.wnd = window_name
         self.img = img
+        self.scheduler = scheduler
+        self.backend = backend or get_backend()
         self.rc = rect if isinstance(rect, Rect) else \
-                  Rect(*(rect or (0, 0) + cv2.getWindowImageRect(self.wnd)[2:]))
+                  Rect(*(rect or (0, 0) + self.backend.window_image_rect(self.wnd)[2:]))
         self.sel_rc = Rect()  # selected area
         self.new_rc = Rect()  # origin rect for resizing
         self.sel_pt = Point()  # point of mouse down event
-        cv2.setMouseCallback(window_name, self.on_mouse_event)
+        # last requested (rect, hilight), redrawn by `set_image`
+        self._drawn: Tuple[Rect, Optional[RectElement]] = (Rect(), None)
+        self._display: Optional[np.ndarray] = None  # persistent display buffer
+        self._dirty: Optional[Rect] = None  # modified area, None - whole image
+        self.progressive = progressive
+        self.preview_ms = preview_ms
+        self.preview_scale = 1
+        self._previews: Dict[int, np.ndarray] = {}  # downscaled images by scale
+        self.backend.set_mouse_callback(window_name, self.on_mouse_event)
         if draw_callback:
             self.set_draw_callback(draw_callback)
         if selection_callback:
             self.set_selection_callback(selection_callback)
 
-    @staticmethod
-    def transformed_rect(rect: Rect, el: Optional[RectElement], vec: Vector,
-                         bounds: Rect) -> Rect:
-        rc: Rect
-        if el == RectElement.area:
-            rc = rect >> vec
-        elif el == RectElement.topleft:
-            rc = (rect >> vec) - vec
-        elif el == RectElement.topright:
-            rc = (rect >> vec.proj_y) + vec.neg_y
-        elif el == RectElement.bottomright:
-            rc = rect + vec
-        elif el == RectElement.bottomleft:
-            rc = (rect >> vec.proj_x) + vec.neg_x
-        elif el == RectElement.top:
-            rc = (rect >> vec.proj_y) - vec.proj_y
-        elif el == RectElement.right:
-            rc = rect + vec.proj_x
-        elif el == RectElement.bottom:
-            rc = rect + vec.proj_y
-        elif el == RectElement.left:
-            rc = (rect >> vec.proj_x) - vec.proj_x
-        elif el == RectElement.from_center:
-            # TODO: combine with other resize flags for mirroring
-            rc = (rect << vec) + vec * 2
-        elif el is None:
-            raise ValueError(el)  # linter
-        rc.normalize()
-        lt, _, br, _ = rc.points
-        b_lt, _, b_br, _ = bounds.points
-        # if rect inside bounds v_lt.x,y > 0, v_br.x,y < 0
-        v_lt = lt - b_lt 
-        v_br = br - b_br
-        # Left X is out of bounds AND exceeds MORE than the opposite side
-        if v_lt.x < 0 and (abs(v_lt.x) - v_br.x) > 0:  # left X bound
-            rc.x = b_lt.x
-            # when whole rectangle is moved its size doesn't change;
-            # both left and right parts are clipped if `from_center`
-            rc.w += v_lt.x * (0 if el == RectElement.area else
-                              2 if el == RectElement.from_center else
-                              1)
-        elif v_br.x > 0:  # right X bound
-            rc.w -= v_br.x * (0 if el == RectElement.area else
-                              2 if el == RectElement.from_center else
-                              1)
-            rc.x = b_br.x - rc.w + 1
-        # Top Y is out of bounds AND exceeds MORE than the opposite side
-        if v_lt.y < 0 and (abs(v_lt.y) - v_br.y) > 0:  # top Y bound
-            rc.y = b_lt.y
-            rc.h += v_lt.y * (0 if el == RectElement.area else
-                              2 if el == RectElement.from_center else
-                              1)
-        elif v_br.y > 0:  # bottom Y bound
-            rc.h -= v_br.y * (0 if el == RectElement.area else
-                              2 if el == RectElement.from_center else
-                              1)
-            rc.y = b_br.y - rc.h + 1
-        return rc
+    transformed_rect = staticmethod(transformed_rect)  # see `geometry`
 
+    @profiled('RectSelection.on_mouse_event')
     def on_mouse_event(self, event, x: int, y: int, flags, param) -> Optional[bool]:
         """
         Mouse callback.
@@ -230,11 +98,11 @@ class RectSelection:
                     self.moving = RectElement.from_center if self.from_center \
                                   else RectElement.bottomright
                     self.new_rc = Rect(x, y, 1, 1)
-                self.draw_rect(self.new_rc)  # update display
+                self.request_draw(self.new_rc)  # update display
                 return True
         elif event == cv2.EVENT_MOUSEMOVE:
             if flags & cv2.EVENT_FLAG_LBUTTON and self.moving:
-                self.draw_rect(
+                self.request_draw(
                     self.transformed_rect(self.new_rc, self.moving,
                                           pt - self.sel_pt, bounds=self.rc)
                 )
@@ -243,7 +111,7 @@ class RectSelection:
                 cursor_area = self.get_cursor_area(x, y)
                 if cursor_area != self._last_cursor_area:
                     self._last_cursor_area = cursor_area
-                    self.draw_rect(self.sel_rc, hilight=cursor_area)
+                    self.request_draw(self.sel_rc, hilight=cursor_area)
                     return True
         elif event == cv2.EVENT_LBUTTONUP and self.moving:
             self.set_selection(self.transformed_rect(
@@ -254,15 +122,24 @@ class RectSelection:
             return True
         elif event == cv2.EVENT_RBUTTONDOWN:  # cancel operation
             self.moving = None
-            self.draw_rect(self.sel_rc, hilight=self.get_cursor_area(x, y))
+            self.request_draw(self.sel_rc, hilight=self.get_cursor_area(x, y))
             self.set_selection(self.sel_rc)  # forced update
             return True
 
+    def request_draw(self, rc: Rect, hilight: RectElement=None):
+        "Draws rect immediately or requests redraw if there's a `scheduler`"
+        self._drawn = rc, hilight
+        if self.scheduler:
+            self.scheduler.request(self, lambda: self.draw_rect(rc, hilight))
+        else:
+            self.draw_rect(rc, hilight)
+
+    @profiled('RectSelection.draw_rect')
     def draw_rect(self, rc: Rect, hilight: RectElement=None):
         if not rc:
-            cv2.imshow(self.wnd, self.img)
+            self.backend.show(self.wnd, self.img)
             return  # invalid empty rect
-        img = self.img.copy()
+        img = self._restore_display()
         tl, tr, br, bl = rc.points
         cv2.rectangle(img, tl, br, self.clr_white)
         for i in (tl, tr, br, bl):
@@ -279,10 +156,16 @@ class RectSelection:
                  RectElement.right: (tr, br), RectElement.bottom: (bl, br)}
         corners = {RectElement.topleft: tl, RectElement.topright: tr,
                    RectElement.bottomright: br, RectElement.bottomleft: bl}
-        if hilight == RectElement.area:
-            tmp = self.img.copy()
-            cv2.rectangle(tmp, tl, br, self.clr_white, thickness=-1)
-            img = cv2.addWeighted(img, 0.9, tmp, 0.1, 0)
+        overlay = self._image_area(rc, self.overlay_margin)
+        if hilight == RectElement.area and overlay:
+            # blending with unchanged pixels keeps them unchanged,
+            # so only the overlay area is blended
+            x, y, w, h = overlay.x, overlay.y, overlay.w, overlay.h
+            region = img[y:y + h, x:x + w]
+            tmp = self.img[y:y + h, x:x + w].copy()
+            cv2.rectangle(tmp, tl - Point(x, y), br - Point(x, y),
+                          self.clr_white, thickness=-1)
+            region[:] = cv2.addWeighted(region, 0.9, tmp, 0.1, 0)
         elif hilight is None:
             pass  # linter
         elif hilight in sides:
@@ -290,36 +173,100 @@ class RectSelection:
         elif hilight in corners:
             cv2.circle(img, corners[hilight], 4, self.clr_white, thickness=-1)
 
-        self.draw_callback(rc, img)
-        cv2.imshow(self.wnd, img)
+        if self.progressive and self.moving:
+            self.preview(rc)
+            drawn = Rect()  # callback doesn't draw on the display
+        else:
+            drawn = self.draw_callback(rc, img)
+        # callback which doesn't report its area forces full restore
+        self._dirty = overlay.union(self._image_area(drawn, self.overlay_margin)) \
+                      if isinstance(drawn, Rect) else None
+        self.backend.show(self.wnd, img)
+
+    def preview(self, rc: Rect):
+        """
+        Calls `draw_callback` with image and `rc` downscaled by
+        `preview_scale`, then adapts the scale to the callback latency
+        """
+        scale = self.preview_scale
+        start = time.perf_counter()
+        self.draw_callback(self.scaled_rect(rc, scale), self.preview_image(scale))
+        elapsed = (time.perf_counter() - start) * 1000
+        # cost is proportional to area, ie. 4x per scale step
+        if elapsed > self.preview_ms and scale < self.max_preview_scale:
+            self.preview_scale = scale * 2
+        elif elapsed < self.preview_ms / 8 and scale > 1:
+            self.preview_scale = scale // 2
+
+    def preview_image(self, scale: int) -> np.ndarray:
+        """
+        Returns read-only image downscaled by `scale`, downscaled images
+        are cached. Scale 1 is a read-only view of the image
+        """
+        if scale not in self._previews:
+            if scale == 1:
+                preview = self.img.view()
+            else:
+                height, width = self.img.shape[:2]
+                size = (max(-(-width // scale), 1), max(-(-height // scale), 1))
+                preview = cv2.resize(self.img, size, interpolation=cv2.INTER_AREA)
+            # callback drawing on it would damage the image or cached preview
+            preview.flags.writeable = False
+            self._previews[scale] = preview
+        return self._previews[scale]
 
-    def get_cursor_area(self, x: int, y: int) -> Optional[RectElement]:
+    @staticmethod
+    def scaled_rect(rc: Rect, scale: int) -> Rect:
+        "Returns rect which covers `rc` in image downscaled by `scale`"
+        x, y = rc.x // scale, rc.y // scale
+        return Rect(x, y, max(-(-(rc.x + rc.w) // scale) - x, 1),
+                    max(-(-(rc.y + rc.h) // scale) - y, 1))
+
+    def _image_area(self, rc: Rect, margin: int=0) -> Rect:
+        "Returns `rc` extended by `margin` and clipped by image bounds"
+        if not rc:
+            return Rect()
+        height, width = self.img.shape[:2]
+        return Rect(rc.x - margin, rc.y - margin, rc.w + margin * 2,
+                    rc.h + margin * 2).intersection(Rect(0, 0, width, height))
+
+    def _restore_display(self) -> np.ndarray:
+        "Restores modified area of the display buffer from the image"
+        if self._display is None or self._display.shape != self.img.shape:
+            self._display = self.img.copy()
+        elif self._dirty is None:
+            np.copyto(self._display, self.img)
+        elif self._dirty:
+            dirty = self._dirty
+            x, y, w, h = dirty.x, dirty.y, dirty.w, dirty.h
+            self._display[y:y + h, x:x + w] = self.img[y:y + h, x:x + w]
+        self._dirty = Rect()
+        return self._display
+
+    def get_cursor_area(self, x: int, y: int,
+                        rect: Rect=None) -> Optional[RectElement]:
         """
         Returns rect part under cursor w/ 2px tolerance:
         * left, top, right, bottom - sides
         * topleft, topright, bottomright, bottomleft - corners
         * area - cursor inside rect
+
+        `rect` - rect to test, default is the selection
         """
         tol = self.cursor_tolerance
-        tl, _, br, _ = self.sel_rc.points
-        if not self.pos_in_rect(x, y, self.sel_rc, allowance=tol):
+        rect = self.sel_rc if rect is None else rect
+        if not rect or not self.pos_in_rect(x, y, rect, allowance=tol):
             return
+        tl, _, br, _ = rect.points
 
-        ret = RectElement(0)
-        if abs(tl.y - y) <= tol:
-            ret |= RectElement.top
-        elif abs(br.y - y) <= tol:
-            ret |= RectElement.bottom
-
-        if abs(tl.x - x) <= tol:
-            ret |= RectElement.left
-        elif abs(br.x - x) <= tol:
-            ret |= RectElement.right
+        # 0 - none, 1 - top/left, 2 - bottom/right
+        row = 1 if abs(tl.y - y) <= tol else 2 if abs(br.y - y) <= tol else 0
+        col = 1 if abs(tl.x - x) <= tol else 2 if abs(br.x - x) <= tol else 0
 
-        if not ret and (tl.x <= x <= br.x and
-                        tl.y <= y <= br.y):
+        if not (row or col) and (tl.x <= x <= br.x and
+                                 tl.y <= y <= br.y):
             return RectElement.area
-        return ret
+        return _cursor_areas[row][col]  # Flag operations are slow
 
     def pos_in_rect(self, x: int, y: int, rect: Rect, allowance: int=0):
         a = allowance
@@ -330,18 +277,28 @@ class RectSelection:
     def set_image(self, img: np.ndarray,
                   rect: Union[Tuple[int, int, int, int], Rect]=None):
         self.img = img
+        self._dirty = None
+        self._previews.clear()
         if rect:
             self.rc = rect if isinstance(rect, Rect) else \
-                    Rect(*(rect or (0, 0) + cv2.getWindowImageRect(self.wnd)[2:]))
-        self.draw_rect(self.sel_rc)
+                    Rect(*(rect or (0, 0) + self.backend.window_image_rect(self.wnd)[2:]))
+        # rect being dragged and highlight stay displayed
+        rc, hilight = self._drawn
+        if not self.moving and rc != self.sel_rc:  # selection was set since
+            rc, hilight = self.sel_rc, None
+        self.draw_rect(rc, hilight)
 
     @property
     def selection(self):
         return self.sel_rc
 
-    def set_draw_callback(self, callback: Callable[[Rect, np.ndarray], None]):
-        "Function to call just before updated rectangle is displayed"
-        self.draw_callback = callback
+    def set_draw_callback(self, callback: Callable[[Rect, np.ndarray], Optional[Rect]]):
+        """
+        Function to call just before updated rectangle is displayed.
+        It should return a Rect which covers everything it has drawn,
+        if it returns None the whole display is restored on the next redraw.
+        """
+        self.draw_callback = profiled('draw_callback')(callback)
 
     def set_selection_callback(self, callback: Callable[[Rect], None]):
         "Function to call when new rect is selected"
@@ -353,7 +310,8 @@ class RectSelection:
 
 
 def selectROI(img: np.ndarray, showCrosshair: bool=True, fromCenter: bool=False,
-              windowName='ROI selector'):
+              windowName='ROI selector', backend=None,
+              viewSize: Tuple[int, int]=None):
     """
     Allows users to select a ROI on the given image.
     Implements OpenCV selectROI interface. NOTE: a point has 1x1 size, not 0x0
@@ -367,13 +325,26 @@ def selectROI(img: np.ndarray, showCrosshair: bool=True, fromCenter: bool=False,
     `windowName` - name of the window where selection process will be shown,
                    default is 'ROI selector'. NOTE: in built-in version of
                    `selectROI` it's the first positional argument
+    `backend` - display backend, default is `display.get_backend()`
+    `viewSize` - (width, height) of the window. If specified, the image is
+                 shown through zoomable `viewport.Viewport` (mouse wheel zooms,
+                 middle button drag pans), selection is in full-resolution
+                 image coordinates anyway. `img` can be `np.memmap` then
 
     Returns:
     (x, y, w, h) - selected rectangle
     """
-    cv2.imshow(windowName, img)
-    sel = RectSelection(windowName, img, show_crosshair=showCrosshair,
-                        from_center=fromCenter)
+    backend = backend or get_backend()
+    if viewSize:
+        from .viewport import ViewportSelection
+        sel = ViewportSelection(windowName, img, viewSize, backend=backend,
+                                show_crosshair=showCrosshair,
+                                from_center=fromCenter)
+        backend.show(windowName, sel.img)
+    else:
+        backend.show(windowName, img)
+        sel = RectSelection(windowName, img, show_crosshair=showCrosshair,
+                            from_center=fromCenter, backend=backend)
 
     print(
         "Select a ROI and then press SPACE or ENTER button!\n"
@@ -381,7 +352,7 @@ def selectROI(img: np.ndarray, showCrosshair: bool=True, fromCenter: bool=False,
     )
 
     while True:
-        k = cv2.waitKey(25) & 0xFF
+        k = backend.wait_key(25) & 0xFF
         if k in (27, ord('\r'), ord(' ')):
             return astuple(sel.selection)
         elif k == ord('c'):
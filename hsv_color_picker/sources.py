@@ -0,0 +1,258 @@
+"""
+Frame sources which decode frames in a background thread, see `FrameSource`.
+
+`VideoSource` - video file or camera, `ImageSequence` - image files,
+`SyntheticSource` - frames generated by a function.
+
+    with VideoSource(0, policy='latest') as source:
+        for frame in source:  # valid until the next frame is read
+            ...
+"""
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Deque, Iterator, List, Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+
+POLICIES = ('all', 'latest')
+
+
+class FrameSource(ABC):
+    """
+    Base class of frame sources. Frames are decoded in a background thread
+    into a ring of preallocated buffers, subclasses implement `read_into`.
+
+    `shape` - frame shape, eg. (height, width, 3)
+    `policy` - 'all' - every frame is handed out, decoding waits for a free
+               buffer (offline processing);
+               'latest' - decoding never waits, only the newest decoded frame
+               is handed out, older ones are dropped (live, lowest latency)
+    `buffers` - number of buffers in the ring, at least 2. One is held by
+                the consumer, one is decoded into, the others keep frames
+                decoded ahead. Default is 3
+
+    `index` - number of the last frame handed out (from 0)
+    `decoded`, `dropped` - frame counters
+    """
+
+    def __init__(self, shape: Tuple[int, ...], policy: str='all',
+                 buffers: int=3, dtype=np.uint8):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy: {policy}")
+        if buffers < 2:
+            raise ValueError("at least 2 buffers are required")
+        self.shape = shape
+        self.policy = policy
+        self.buffers: List[np.ndarray] = [np.empty(shape, dtype) for _ in range(buffers)]
+        self.index = -1
+        self.decoded = 0
+        self.dropped = 0
+        self._free: Deque[int] = deque(range(buffers))
+        self._ready: Deque[Tuple[int, int]] = deque()  # (frame index, buffer)
+        self._held: Optional[int] = None  # buffer of the consumer
+        self._cond = threading.Condition()
+        self._ended = False
+        self._stopped = False
+        self._error: Optional[BaseException] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @abstractmethod
+    def read_into(self, buf: np.ndarray) -> bool:
+        "Decodes next frame into `buf`, returns False at the end of the source"
+
+    def release(self):
+        "Releases resources of the source, called when decoding stops"
+
+    def start(self) -> "FrameSource":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._decode, daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        "Stops decoding and waits for the thread"
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        else:
+            self.release()
+
+    def __enter__(self) -> "FrameSource":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _take_buffer(self) -> Optional[int]:
+        "Returns buffer to decode into, None if stopped (called under lock)"
+        while not self._stopped:
+            if self._free:
+                return self._free.popleft()
+            if self.policy == 'latest' and self._ready:
+                self.dropped += 1
+                return self._ready.popleft()[1]
+            self._cond.wait()
+        return None
+
+    def _decode(self):
+        try:
+            while True:
+                with self._cond:
+                    i = self._take_buffer()
+                if i is None:
+                    return
+                if not self.read_into(self.buffers[i]):
+                    with self._cond:
+                        self._free.append(i)
+                    return
+                with self._cond:
+                    self._ready.append((self.decoded, i))
+                    self.decoded += 1
+                    if self.policy == 'latest':
+                        while len(self._ready) > 1:  # older frames are dropped
+                            self._free.append(self._ready.popleft()[1])
+                            self.dropped += 1
+                    self._cond.notify_all()
+        except BaseException as e:
+            self._error = e
+        finally:
+            self.release()
+            with self._cond:
+                self._ended = True
+                self._cond.notify_all()
+
+    def read(self, timeout: float=None) -> Optional[np.ndarray]:
+        """
+        Returns next frame (newest frame if policy is 'latest') or None at
+        the end of the source. Returned buffer is reused after the next
+        `read` call, copy the frame to keep it longer.
+        Errors of the decoding thread are raised here.
+
+        `timeout` - seconds to wait for a frame, then TimeoutError is raised
+        """
+        self.start()
+        with self._cond:
+            if self._held is not None:
+                self._free.append(self._held)
+                self._held = None
+                self._cond.notify_all()
+            if not self._cond.wait_for(lambda: self._ready or self._ended, timeout):
+                raise TimeoutError("no frame decoded in time")
+            if not self._ready:
+                if self._error is not None:
+                    raise self._error
+                return None
+            self.index, self._held = self._ready.popleft()
+            return self.buffers[self._held]
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+
+class VideoSource(FrameSource):
+    """
+    Video file or camera read with `cv2.VideoCapture`. The first frame is
+    decoded when the source is created, buffers are sized by it (reported
+    frame size may be 0 or differ from decoded frames).
+
+    `source` - file name, URL or camera index
+    `api_preference` - capture API, eg. `cv2.CAP_DSHOW`. Default is any
+    See `FrameSource` for other arguments.
+    """
+
+    def __init__(self, source: Union[str, int], api_preference: int=cv2.CAP_ANY,
+                 **kwargs):
+        self.capture = cv2.VideoCapture(source, api_preference)
+        if not self.capture.isOpened():
+            raise ValueError(f"can't open video: {source}")
+        ok, self._first = self.capture.read()
+        if not ok:
+            self.capture.release()
+            raise ValueError(f"can't read video: {source}")
+        super().__init__(self._first.shape, **kwargs)
+
+    @property
+    def fps(self) -> float:
+        return self.capture.get(cv2.CAP_PROP_FPS)
+
+    def read_into(self, buf: np.ndarray) -> bool:
+        if self._first is not None:
+            np.copyto(buf, self._first)
+            self._first = None
+            return True
+        ok, frame = self.capture.read(buf)  # decoded in place if shape matches
+        if ok and frame is not buf:
+            np.copyto(buf, frame)
+        return ok
+
+    def release(self):
+        self.capture.release()
+
+
+class ImageSequence(FrameSource):
+    """
+    Image files as frames. Images of other size than the first one are
+    resized to it.
+
+    `paths` - image file names in frame order
+    See `FrameSource` for other arguments.
+    """
+
+    def __init__(self, paths: Sequence[str], **kwargs):
+        self.paths = list(paths)
+        if not self.paths:
+            raise ValueError("no images")
+        self._first = self._imread(self.paths[0])
+        self._next = 0
+        super().__init__(self._first.shape, **kwargs)
+
+    @staticmethod
+    def _imread(path: str) -> np.ndarray:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError(f"can't read image: {path}")
+        return img
+
+    def read_into(self, buf: np.ndarray) -> bool:
+        if self._next >= len(self.paths):
+            return False
+        img = self._first if self._next == 0 else self._imread(self.paths[self._next])
+        self._first = None
+        self._next += 1
+        if img.shape == buf.shape:
+            np.copyto(buf, img)
+        else:
+            cv2.resize(img, buf.shape[1::-1], buf)
+        return True
+
+
+class SyntheticSource(FrameSource):
+    """
+    Frames generated by a function, eg. for tests and benchmarks.
+
+    `generate` - function of (frame index, buffer) which fills the buffer
+    `count` - number of frames. Default is None - endless
+    See `FrameSource` for other arguments.
+    """
+
+    def __init__(self, generate: Callable[[int, np.ndarray], None],
+                 shape: Tuple[int, ...], count: int=None, **kwargs):
+        self.generate = generate
+        self.count = count
+        self._next = 0
+        super().__init__(shape, **kwargs)
+
+    def read_into(self, buf: np.ndarray) -> bool:
+        if self.count is not None and self._next >= self.count:
+            return False
+        self.generate(self._next, buf)
+        self._next += 1
+        return True
@@ -0,0 +1,234 @@
+"""
+Zoomable view of very large images, see `Viewport` and `ViewportSelection`
+"""
+import math
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+from .cv_utils import LRUCache
+from .selection import Point, Rect, RectElement, RectSelection
+
+
+class ImagePyramid:
+    """
+    Image pyramid which is built lazily tile by tile. Level 0 is the source
+    image, level `k` is downscaled by `2**k`. Tiles of levels > 0 are built
+    from 2x2 tiles of the previous level and kept in LRU cache.
+
+    `source` - image. Any array-like object with `shape` and numpy-style
+               slicing can be used, eg. `np.memmap`; only requested regions
+               of level 0 are read
+    `tile` - tile size in px. Default is 512
+    `cache_bytes` - memory budget of tiles cache. Default is 256MB
+    """
+
+    def __init__(self, source, tile: int=512, cache_bytes: int=256 * 2**20):
+        self.source = source
+        self.tile = tile
+        self.tiles = LRUCache(cache_bytes)
+        height, width = source.shape[:2]
+        self.shapes = [(height, width)]  # (height, width) of each level
+        while max(height, width) > tile:
+            height, width = (height + 1) // 2, (width + 1) // 2
+            self.shapes.append((height, width))
+
+    @property
+    def levels(self) -> int:
+        return len(self.shapes)
+
+    def get_tile(self, level: int, ty: int, tx: int) -> np.ndarray:
+        "Returns tile at (`ty`, `tx`) tile coordinates of the level"
+        t = self.tile
+        if level == 0:
+            return np.asarray(self.source[ty * t:(ty + 1) * t, tx * t:(tx + 1) * t])
+        key = level, ty, tx
+        tile = self.tiles.get(key)
+        if tile is None:
+            src = self.region(level - 1, tx * t * 2, ty * t * 2, t * 2, t * 2)
+            height, width = self.shapes[level]
+            size = (min(t, width - tx * t), min(t, height - ty * t))
+            tile = cv2.resize(src, size, interpolation=cv2.INTER_AREA)
+            self.tiles.put(key, tile)
+        return tile
+
+    def region(self, level: int, x: int, y: int, w: int, h: int) -> np.ndarray:
+        "Returns region of the level clipped by level bounds"
+        height, width = self.shapes[level]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, width), min(y + h, height)
+        if level == 0:
+            return np.asarray(self.source[y0:y1, x0:x1])
+        t = self.tile
+        rows = []
+        for ty in range(y0 // t, (y1 - 1) // t + 1):
+            row = [self.get_tile(level, ty, tx)
+                   for tx in range(x0 // t, (x1 - 1) // t + 1)]
+            rows.append(np.concatenate(row, axis=1) if len(row) > 1 else row[0])
+        ret = np.concatenate(rows) if len(rows) > 1 else rows[0]
+        oy, ox = y0 // t * t, x0 // t * t
+        return ret[y0 - oy:y1 - oy, x0 - ox:x1 - ox]
+
+
+class Viewport:
+    """
+    Visible window of a large image. Renders only the visible part of the
+    image using the pyramid level which matches zoom.
+
+    `source` - image, see `ImagePyramid`
+    `size` - (width, height) of the view in px
+    `max_zoom` - maximum zoom. Default is 16 (1 image px is 16x16 view px)
+
+    `zoom` - view px per image px
+    `origin` - image coordinates of top-left corner of the view
+    """
+
+    def __init__(self, source, size: Tuple[int, int]=(1280, 720),
+                 max_zoom: float=16):
+        self.pyramid = source if isinstance(source, ImagePyramid) \
+                       else ImagePyramid(source)
+        self.size = size
+        self.max_zoom = max_zoom
+        height, width = self.image_size
+        self.min_zoom = min(size[0] / width, size[1] / height, 1)
+        self.zoom = self.min_zoom
+        self.origin = (0., 0.)
+        self.clamp()
+
+    @property
+    def image_size(self) -> Tuple[int, int]:
+        "(height, width) of the full-resolution image"
+        return self.pyramid.shapes[0]
+
+    def to_image(self, pt: Point) -> Point:
+        "Maps view point to full-resolution image pixel"
+        return Point(math.floor(self.origin[0] + pt.x / self.zoom),
+                     math.floor(self.origin[1] + pt.y / self.zoom))
+
+    def to_view(self, pt: Point) -> Point:
+        "Maps image point (top-left corner of a pixel) to view point"
+        return Point(math.floor((pt.x - self.origin[0]) * self.zoom),
+                     math.floor((pt.y - self.origin[1]) * self.zoom))
+
+    def rect_to_view(self, rc: Rect) -> Rect:
+        "Maps image rect to the view, each rect is at least 1px in size"
+        lt = self.to_view(Point(rc.x, rc.y))
+        rb = self.to_view(Point(rc.x + rc.w, rc.y + rc.h))
+        return Rect(lt.x, lt.y, max(rb.x - lt.x, 1), max(rb.y - lt.y, 1))
+
+    def clamp(self):
+        "Keeps image in the view, image smaller than the view is centered"
+        height, width = self.image_size
+        origin = []
+        for img_len, view_len, o in zip((width, height), self.size, self.origin):
+            view_len /= self.zoom
+            if img_len <= view_len:
+                origin.append((img_len - view_len) / 2)
+            else:
+                origin.append(min(max(o, 0.), img_len - view_len))
+        self.origin = tuple(origin)
+
+    def zoom_at(self, pt: Point, factor: float):
+        "Zooms by `factor` keeping image point under view point `pt` in place"
+        x = self.origin[0] + pt.x / self.zoom
+        y = self.origin[1] + pt.y / self.zoom
+        self.zoom = min(max(self.zoom * factor, self.min_zoom), self.max_zoom)
+        self.origin = x - pt.x / self.zoom, y - pt.y / self.zoom
+        self.clamp()
+
+    def pan(self, dx: int, dy: int):
+        "Moves the image by (`dx`, `dy`) view px"
+        self.origin = (self.origin[0] - dx / self.zoom,
+                       self.origin[1] - dy / self.zoom)
+        self.clamp()
+
+    @property
+    def level(self) -> int:
+        "Pyramid level which is used at current zoom"
+        level = math.floor(math.log2(1 / self.zoom)) if self.zoom < 1 else 0
+        return min(level, self.pyramid.levels - 1)
+
+    def render(self) -> np.ndarray:
+        "Returns view image, area outside the image is black"
+        view_w, view_h = self.size
+        level = self.level
+        scale = 2 ** -level
+        height, width = self.pyramid.shapes[level]
+        # visible region of the level
+        x0 = max(math.floor(self.origin[0] * scale), 0)
+        y0 = max(math.floor(self.origin[1] * scale), 0)
+        x1 = min(math.ceil((self.origin[0] + view_w / self.zoom) * scale), width)
+        y1 = min(math.ceil((self.origin[1] + view_h / self.zoom) * scale), height)
+        src = self.pyramid.region(level, x0, y0, x1 - x0, y1 - y0)
+        view = np.zeros((view_h, view_w, *src.shape[2:]), src.dtype)
+        # image coordinates of level pixels are scaled back for exact mapping
+        full_h, full_w = self.image_size
+        lt = self.to_view(Point(x0 / scale, y0 / scale))
+        rb = self.to_view(Point(min(x1 / scale, full_w), min(y1 / scale, full_h)))
+        if rb.x <= lt.x or rb.y <= lt.y:
+            return view
+        interpolation = cv2.INTER_AREA if self.zoom / scale < 1 else cv2.INTER_NEAREST
+        src = cv2.resize(src, (rb.x - lt.x, rb.y - lt.y), interpolation=interpolation)
+        vx0, vy0 = max(lt.x, 0), max(lt.y, 0)
+        vx1, vy1 = min(rb.x, view_w), min(rb.y, view_h)
+        view[vy0:vy1, vx0:vx1] = src[vy0 - lt.y:vy1 - lt.y, vx0 - lt.x:vx1 - lt.x]
+        return view
+
+
+class ViewportSelection(RectSelection):
+    """
+    Rectangle selection on a large image shown through `Viewport`.
+    Mouse wheel zooms, drag with the middle button pans the image.
+    Selection (see `selection`, `selection_callback`) is in full-resolution
+    image coordinates, `draw_callback` receives view image and view rect.
+
+    `source` - image, see `ImagePyramid`
+    `view_size` - (width, height) of the view in px
+    See `RectSelection` for other arguments.
+    """
+    zoom_step = 1.25
+
+    def __init__(self, window_name: str, source,
+                 view_size: Tuple[int, int]=(1280, 720), **kwargs):
+        self.viewport = Viewport(source, view_size)
+        self._pan_from = None
+        height, width = self.viewport.image_size
+        super().__init__(window_name, self.viewport.render(),
+                         Rect(0, 0, width, height), **kwargs)
+        self._update_tolerance()
+
+    def _update_tolerance(self):
+        "Cursor tolerance is specified in view px"
+        self.cursor_tolerance = max(round(RectSelection.cursor_tolerance /
+                                          self.viewport.zoom), 0)
+
+    def refresh(self):
+        "Renders the view after zoom or pan"
+        self._update_tolerance()
+        self.set_image(self.viewport.render())
+
+    def on_mouse_event(self, event, x: int, y: int, flags, param):
+        if event == cv2.EVENT_MOUSEWHEEL:
+            delta = (flags >> 16) & 0xFFFF  # see `cv2.getMouseWheelDelta`
+            delta -= 0x10000 if delta & 0x8000 else 0
+            self.viewport.zoom_at(Point(x, y), self.zoom_step if delta > 0
+                                  else 1 / self.zoom_step)
+            self.refresh()
+            return True
+        elif event == cv2.EVENT_MBUTTONDOWN:
+            self._pan_from = Point(x, y)
+            return True
+        elif event == cv2.EVENT_MBUTTONUP:
+            self._pan_from = None
+            return True
+        elif event == cv2.EVENT_MOUSEMOVE and self._pan_from:
+            self.viewport.pan(*(Point(x, y) - self._pan_from))
+            self._pan_from = Point(x, y)
+            self.refresh()
+            return True
+        pt = self.viewport.to_image(Point(x, y))
+        return super().on_mouse_event(event, pt.x, pt.y, flags, param)
+
+    def draw_rect(self, rc: Rect, hilight: RectElement=None):
+        super().draw_rect(self.viewport.rect_to_view(rc) if rc else rc, hilight)
@@ -1,8 +1,27 @@
+import json
+import os
+import tempfile
 import unittest as ut
 
-from hsv_color_picker import SliderHSV
-from hsv_color_picker.cv_utils import Align, Vector, alignment_vector
-from hsv_color_picker.selection import Rect, RectElement, RectSelection
+import cv2
+import numpy as np
+
+from hsv_color_picker import SliderHSV, batch, profiling
+from hsv_color_picker.cv_utils import (Align, BufferPool, LRUCache, Vector,
+                                       alignment_vector, put_text_block,
+                                       text_layouts)
+from hsv_color_picker.display import EventTrace, MemoryBackend, replay
+from hsv_color_picker.histogram import StreamingHistogram
+from hsv_color_picker.multi_selection import GridIndex, MultiRectSelection
+from hsv_color_picker.masking import (ColorClassifier, FrameMasker,
+                                      HSVRange, IncrementalMasker, RangeMask,
+                                      ROIMasker, SliderMask, TiledMasker,
+                                      range_mask, suggest_range)
+from hsv_color_picker.render import RenderScheduler
+from hsv_color_picker.sources import FrameSource, ImageSequence, SyntheticSource, VideoSource
+from hsv_color_picker.selection import (Point, Rect, RectElement,
+                                        RectSelection)
+from hsv_color_picker.viewport import Viewport, ViewportSelection
 
 
 class Test(ut.TestCase):
@@ -28,6 +47,22 @@ class Test(ut.TestCase):
         self.assertEqual(w.shift_hue(-10), 170)
 
 
+class TestSatBrPlane(ut.TestCase):
+    def test_matches_cvtColor(self):
+        for size in (128, 301):
+            w = SliderHSV('test', size=size, backend=MemoryBackend())
+            ramp = np.uint8(np.linspace(0., 255., size))
+            tpl = np.empty((size, size, 3), np.uint8)
+            tpl[..., 1], tpl[..., 2] = ramp[:, None], ramp[None]
+            dst = np.empty_like(tpl)
+            for hue in range(180):
+                tpl[..., 0] = hue
+                expected = cv2.cvtColor(tpl, cv2.COLOR_HSV2BGR)
+                self.assertIs(w.render_sat_br_plane(hue, dst), dst)
+                diff = cv2.absdiff(dst, expected)
+                self.assertLessEqual(diff.max(), 1, f"size {size}, hue {hue}")
+
+
 class TestVectors(ut.TestCase):
     def test_vectors_equal(self):
         self.assertEqual(Vector(3, 4), Vector(3, 4))
@@ -42,6 +77,376 @@ class TestVectors(ut.TestCase):
         self.assertEqual(RectSelection.transformed_rect(
             Rect(16, 16, 1, 1), RectElement.left, Vector(x=1), bs
         ), Rect(16, 16, 2, 1))
+        with self.assertRaises(ValueError):
+            RectSelection.transformed_rect(Rect(1, 1, 1, 1), None, Vector(), bs)
+
+    def test_rect(self):
+        from dataclasses import astuple, replace
+        rc = Rect(1, 2, 3, 4)
+        self.assertFalse(hasattr(rc, '__dict__') or hasattr(Vector(), '__dict__'))
+        self.assertEqual(astuple(rc), (1, 2, 3, 4))
+        self.assertEqual(replace(rc, w=5), Rect(1, 2, 5, 4))
+        self.assertEqual(repr(rc), "Rect(x=1, y=2, w=3, h=4)")
+        self.assertIs(rc.points, rc.points)  # cached
+        rc.w = 10  # cache is invalidated by changes
+        self.assertEqual(rc.points, (Point(1, 2), Point(10, 2),
+                                     Point(10, 5), Point(1, 5)))
+
+
+class TestLazyImports(ut.TestCase):
+    def test_geometry_without_cv2(self):
+        import subprocess
+        import sys
+        code = ("import sys; import hsv_color_picker as p; "
+                "p.transformed_rect(p.Rect(0, 0, 2, 2), p.RectElement.area, "
+                "p.Vector(1, 1), p.Rect(0, 0, 9, 9)); "
+                "sys.exit('cv2' in sys.modules or 'numpy' in sys.modules)")
+        subprocess.run([sys.executable, '-c', code], check=True)
+        import hsv_color_picker
+        self.assertIs(hsv_color_picker.Rect, Rect)
+        self.assertIs(RectSelection.transformed_rect,
+                      hsv_color_picker.transformed_rect)
+        with self.assertRaises(AttributeError):
+            hsv_color_picker.missing
+
+
+class TestRectSelectionRedraw(ut.TestCase):
+    @staticmethod
+    def full_redraw(img, rc, hilight):
+        "Reference: redraw of the whole image copy"
+        img, orig = img.copy(), img
+        tl, tr, br, bl = rc.points
+        cv2.rectangle(img, tl, br, RectSelection.clr_white)
+        for i in (tl, tr, br, bl):
+            cv2.circle(img, i, 2, RectSelection.clr_white, thickness=-1)
+        if hilight == RectElement.area:
+            tmp = orig.copy()
+            cv2.rectangle(tmp, tl, br, RectSelection.clr_white, thickness=-1)
+            img = cv2.addWeighted(img, 0.9, tmp, 0.1, 0)
+        elif hilight == RectElement.topright:
+            cv2.circle(img, tr, 4, RectSelection.clr_white, thickness=-1)
+        return img
+
+    def test_incremental_redraw(self):
+        img = np.random.default_rng(0).integers(0, 256, (60, 80, 3), dtype=np.uint8)
+        backend = MemoryBackend()
+        sel = RectSelection('test', img, (0, 0, 80, 60), backend=backend)
+        for rc, hilight in ((Rect(10, 10, 20, 20), RectElement.area),
+                            (Rect(0, 0, 5, 5), RectElement.topright),
+                            (Rect(50, 30, 30, 30), RectElement.area),
+                            (Rect(40, 20, 10, 10), None)):
+            sel.draw_rect(rc, hilight)
+            np.testing.assert_array_equal(backend.frame('test'),
+                                          self.full_redraw(img, rc, hilight))
+
+
+class TestProgressiveSelection(ut.TestCase):
+    def test_preview(self):
+        import time
+        img = np.random.default_rng(0).integers(0, 256, (400, 600, 3), dtype=np.uint8)
+        calls, selected = [], []
+
+        def consumer(rc, preview):
+            calls.append((rc, preview.shape))
+            time.sleep(0.002)
+        sel = RectSelection('test', img, (0, 0, 600, 400), draw_callback=consumer,
+                            selection_callback=selected.append,
+                            backend=MemoryBackend(), progressive=True, preview_ms=1)
+        trace = EventTrace.drag((100, 100), (300, 200), steps=10)
+        replay(trace, sel.on_mouse_event)
+        self.assertEqual(selected, [Rect(100, 100, 201, 101)])
+        scales = [round(600 / shape[1]) for _, shape in calls]
+        self.assertEqual(scales[:6], [1, 2, 4, 8, 16, 16])  # too slow at any scale
+        rc, shape = calls[-1]
+        self.assertEqual(shape, (25, 38, 3))
+        self.assertEqual(rc, RectSelection.scaled_rect(Rect(100, 100, 201, 101), 16))
+        self.assertEqual(rc, Rect(6, 6, 13, 7))
+
+        sel.draw_callback = lambda rc, preview: calls.append((rc, preview.shape))
+        replay(EventTrace.drag((50, 50), (150, 150), steps=10),
+               sel.on_mouse_event)  # fast callback, scale goes down
+        self.assertEqual(sel.preview_scale, 1)
+        self.assertEqual(calls[-1], (Rect(50, 50, 101, 101), img.shape))
+
+    def test_read_only_preview(self):
+        img = np.random.default_rng(0).integers(0, 256, (400, 600, 3), dtype=np.uint8)
+        original, errors = img.copy(), []
+
+        def drawing(rc, preview):
+            tl, _, br, _ = rc.points
+            try:
+                cv2.rectangle(preview, tl, br, (255, 255, 255), thickness=-1)
+            except cv2.error as e:
+                errors.append(e)
+        sel = RectSelection('test', img, (0, 0, 600, 400), draw_callback=drawing,
+                            backend=MemoryBackend(), progressive=True)
+        for scale in (1, 4):
+            sel.preview_scale = scale
+            sel.preview_ms = 1e6 if scale == 1 else 0  # keep the scale
+            replay(EventTrace.drag((100, 100), (300, 200), steps=3),
+                   sel.on_mouse_event)
+            self.assertFalse(sel.preview_image(scale).flags.writeable)
+        self.assertTrue(errors)
+        np.testing.assert_array_equal(img, original)
+
+
+class TestMultiRectSelection(ut.TestCase):
+    @staticmethod
+    def full_redraw(img, sel, hilight=None):
+        "Reference: all rects drawn on the image copy"
+        out = img.copy()
+        for i, rc in enumerate(sel.rects):
+            if i != sel.active:
+                sel.draw_passive(out, rc)
+        if sel.active is not None:
+            out = TestRectSelectionRedraw.full_redraw(out, sel.sel_rc, None)
+            if hilight == RectElement.area:
+                tl, _, br, _ = sel.sel_rc.points
+                tmp = img.copy()
+                cv2.rectangle(tmp, tl, br, RectSelection.clr_white, thickness=-1)
+                area = sel._image_area(sel.sel_rc, sel.overlay_margin)
+                y, x = slice(area.y, area.y + area.h), slice(area.x, area.x + area.w)
+                out[y, x] = cv2.addWeighted(out[y, x], 0.9, tmp[y, x], 0.1, 0)
+        return out
+
+    def test_editing(self):
+        img = np.random.default_rng(0).integers(0, 256, (120, 160, 3), dtype=np.uint8)
+        backend = MemoryBackend()
+        rects = np.array([(10, 10, 30, 20), (60, 40, 30, 30), (70, 50, 50, 40)])
+        sel = MultiRectSelection('test', img, (0, 0, 160, 120), rects=rects,
+                                 backend=backend, cell=32)
+        np.testing.assert_array_equal(backend.frame('test'), self.full_redraw(img, sel))
+
+        sel.on_mouse_event(cv2.EVENT_MOUSEMOVE, 80, 60, 0, None)
+        self.assertEqual(sel.active, 2)  # topmost of overlapping rects
+        np.testing.assert_array_equal(backend.frame('test'),
+                                      self.full_redraw(img, sel, RectElement.area))
+        sel.on_mouse_event(cv2.EVENT_MOUSEMOVE, 20, 20, 0, None)
+        self.assertEqual(sel.active, 0)
+        np.testing.assert_array_equal(backend.frame('test'),
+                                      self.full_redraw(img, sel, RectElement.area))
+
+        replay(EventTrace.drag((20, 20), (30, 25), steps=5), sel.on_mouse_event)
+        self.assertEqual(sel.rects[0], Rect(20, 15, 30, 20))
+        self.assertEqual(sel.hit_test(15, 12), None)
+        self.assertEqual(sel.hit_test(45, 30), 0)
+        sel.on_mouse_event(cv2.EVENT_MOUSEMOVE, 140, 10, 0, None)
+        self.assertEqual(sel.active, None)
+        np.testing.assert_array_equal(backend.frame('test'), self.full_redraw(img, sel))
+
+        replay(EventTrace.drag((130, 5), (150, 25), steps=5), sel.on_mouse_event)
+        self.assertEqual(len(sel.rects), 4)
+        self.assertEqual(sel.rects[3], Rect(130, 5, 21, 21))
+        sel.remove(1)
+        self.assertEqual(sel.active, 2)
+        sel.on_mouse_event(cv2.EVENT_MOUSEMOVE, 80, 60, 0, None)
+        np.testing.assert_array_equal(backend.frame('test'),
+                                      self.full_redraw(img, sel, RectElement.area))
+
+        arr = sel.to_array()
+        self.assertEqual(arr.dtype, np.int32)
+        self.assertEqual(arr.tolist(), [[20, 15, 30, 20], [70, 50, 50, 40],
+                                        [130, 5, 21, 21]])
+        sel.from_array(arr[::-1])
+        self.assertEqual(sel.to_array().tolist(), arr[::-1].tolist())
+
+    def test_hit_test(self):
+        rng = np.random.default_rng(1)
+        img = np.zeros((480, 640, 3), np.uint8)
+        xy = rng.integers(0, 600, (300, 2)) % (600, 440)
+        rects = np.hstack([xy, rng.integers(2, 40, (300, 2))])
+        sel = MultiRectSelection('test', img, rects=rects, backend=MemoryBackend())
+        for x, y in rng.integers(0, 480, (500, 2)):
+            expected = next((i for i in reversed(range(len(sel.rects)))
+                             if sel.get_cursor_area(x, y, sel.rects[i])), None)
+            self.assertEqual(sel.hit_test(x, y), expected)
+
+        index = GridIndex(16)
+        index.insert(0, Rect(10, 10, 20, 20))
+        index.update(0, Rect(40, 40, 5, 5))
+        self.assertEqual(index.query(Rect(0, 0, 35, 35)), set())
+        self.assertEqual(index.query(Rect(44, 44, 1, 1)), {0})
+        index.remove(0)
+        self.assertEqual(dict(index.cells), {})
+
+
+class TestRenderScheduler(ut.TestCase):
+    def test_coalescing(self):
+        img = np.zeros((60, 80, 3), np.uint8)
+        backend = MemoryBackend()
+        scheduler = RenderScheduler(backend=backend)
+        selected = []
+        sel = RectSelection('test', img, (0, 0, 80, 60), scheduler=scheduler,
+                            selection_callback=selected.append, backend=backend)
+        sel.on_mouse_event(cv2.EVENT_LBUTTONDOWN, 10, 10, 0, None)
+        for x in range(11, 30):
+            sel.on_mouse_event(cv2.EVENT_MOUSEMOVE, x, x,
+                               cv2.EVENT_FLAG_LBUTTON, None)
+        sel.on_mouse_event(cv2.EVENT_LBUTTONUP, 30, 30, 0, None)
+        self.assertEqual(selected, [Rect(10, 10, 21, 21)])
+        self.assertEqual(backend.shown['test'], 0)
+        self.assertTrue(scheduler.flush())
+        self.assertEqual(backend.shown['test'], 1)
+        self.assertEqual((scheduler.requested, scheduler.rendered), (20, 1))
+
+    def test_deferred_first_render(self):
+        backend = MemoryBackend()
+        scheduler = RenderScheduler(backend=backend)
+        w = SliderHSV('test', size=64, scheduler=scheduler, backend=backend)
+        self.assertIsNone(w._h_comp)
+        self.assertEqual(backend.shown['test'], 1)  # placeholder only
+        self.assertTrue(scheduler.flush())
+        self.assertIsNotNone(w._h_comp)
+        self.assertEqual(w.sv.shape, (64 + 16, 64, 3))
+
+
+class TestHeadlessDisplay(ut.TestCase):
+    def test_replay(self):
+        backend = MemoryBackend()
+        w = SliderHSV('test', size=128, backend=backend)
+        trace = EventTrace.drag((10, 10), (100, 60), steps=10) + \
+                EventTrace.drag((0, 130), (127, 130), steps=10)  # hue slider
+        stats = replay(trace, backend.callbacks['test'])
+        self.assertEqual(stats['events'], 24)
+        self.assertLessEqual(stats['p50'], stats['max'])
+        self.assertEqual(w.hue, 179)
+        self.assertEqual(w.sel.selection, Rect(10, 10, 91, 51))
+        self.assertEqual(backend.frame('test').shape, (128 + 16, 128, 3))
+
+
+class TestProfiling(ut.TestCase):
+    def test_profiled_replay(self):
+        backend = MemoryBackend()
+        w = SliderHSV('test', size=128, backend=backend)
+        trace = EventTrace.drag((10, 10), (100, 60), steps=10)
+        replay(trace, backend.callbacks['test'])
+        self.assertIsNone(profiling.get_profiler())
+
+        profiler = profiling.enable(profiling.Profiler())
+        try:
+            replay(trace, backend.callbacks['test'])
+            w.set_value(20)
+        finally:
+            self.assertIs(profiling.disable(), profiler)
+        replay(trace, backend.callbacks['test'])  # isn't recorded
+
+        stats = profiler.stats()
+        self.assertEqual(stats['SliderHSV.on_mouse_event']['count'], 12)
+        self.assertEqual(stats['RectSelection.on_mouse_event']['count'], 12)
+        self.assertEqual(stats['SliderHSV.set_value']['count'], 1)
+        self.assertEqual(stats['draw_callback']['count'],
+                         stats['RectSelection.draw_rect']['count'])
+        self.assertGreater(stats['put_text_block']['count'], 0)
+        shown = stats['MemoryBackend.show']['count']
+        self.assertEqual(stats['frame test']['count'], shown - 1)
+        s = stats['SliderHSV.on_mouse_event']
+        self.assertLessEqual(s['p50_ms'], s['max_ms'])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'trace.json')
+            profiler.dump_trace(path)
+            with open(path) as f:
+                events = json.load(f)['traceEvents']
+        self.assertEqual(len(events), sum(profiler.counts.values()))
+        self.assertEqual({e['ph'] for e in events}, {'X'})
+        outer = next(e for e in events if e['name'] == 'SliderHSV.on_mouse_event')
+        inner = next(e for e in events if e['name'] == 'RectSelection.on_mouse_event')
+        self.assertLessEqual(outer['ts'], inner['ts'])
+        self.assertLessEqual(inner['ts'] + inner['dur'], outer['ts'] + outer['dur'])
+
+
+class TestStreamingHistogram(ut.TestCase):
+    hsv = cv2.cvtColor(np.random.default_rng(0).integers(
+        0, 256, (480, 640, 3), dtype=np.uint8), cv2.COLOR_BGR2HSV)
+
+    def test_budget(self):
+        full = cv2.calcHist([self.hsv], [0], None, [180], [0, 180]).ravel()
+        full /= full.sum()
+        for sampling in ('stride', 'random'):
+            hist = StreamingHistogram(budget=10000, sampling=sampling, seed=0)
+            self.assertLessEqual(len(hist.sample(self.hsv)), 10000)
+            self.assertLessEqual(len(hist.sample(self.hsv[100:, 100:])), 10000)
+            hist.update(self.hsv)
+            self.assertAlmostEqual(hist.hue.sum(), 1, places=5)
+            self.assertAlmostEqual(hist.sv.sum(), 1, places=5)
+            self.assertLess(np.abs(hist.hue - full).sum(), 0.2)
+
+    def test_moving_average(self):
+        hist = StreamingHistogram(alpha=0.5)
+        red, blue = np.zeros((2, 10, 10, 3), np.uint8)
+        blue[..., 0] = 120
+        hist.update(red)
+        hist.update(blue)
+        self.assertAlmostEqual(hist.hue[0], 0.5)
+        self.assertAlmostEqual(hist.hue[120], 0.5)
+
+    def test_slider_overlays(self):
+        backend = MemoryBackend()
+        scheduler = RenderScheduler(backend=backend)
+        w = SliderHSV('test', size=128, scheduler=scheduler, backend=backend,
+                      histogram=StreamingHistogram(), histogram_height=20)
+        scheduler.flush()
+        plain = backend.frame('test')
+        self.assertEqual(plain.shape, (128 + 16 + 20, 128, 3))
+        self.assertFalse(plain[-20:].any())
+        shown = backend.shown['test']
+        for _ in range(3):
+            w.update_histogram(self.hsv)
+        self.assertEqual(backend.shown['test'], shown)  # drawn on redraw only
+        scheduler.flush()
+        frame = backend.frame('test')
+        self.assertEqual(backend.shown['test'], shown + 1)
+        self.assertTrue(frame[-20:].any())
+        self.assertTrue((frame[:128] != plain[:128]).any())
+
+    def test_drag_with_live_histogram(self):
+        backend = MemoryBackend()
+        scheduler = RenderScheduler(backend=backend)
+        w = SliderHSV('test', size=128, scheduler=scheduler, backend=backend,
+                      histogram=StreamingHistogram())
+        scheduler.flush()
+        w.sel.on_mouse_event(cv2.EVENT_LBUTTONDOWN, 20, 20, 0, None)
+        for x in (40, 60, 80):  # frames arrive while dragging (see demo.py)
+            w.sel.on_mouse_event(cv2.EVENT_MOUSEMOVE, x, x,
+                                 cv2.EVENT_FLAG_LBUTTON, None)
+            w.update_histogram(self.hsv)
+            scheduler.flush()
+            np.testing.assert_array_equal(backend.frame('test')[x, x], (255, 255, 255))
+        w.sel.on_mouse_event(cv2.EVENT_LBUTTONUP, 80, 80, 0, None)
+        w.sel.on_mouse_event(cv2.EVENT_MOUSEMOVE, 50, 20, 0, None)  # top side
+        scheduler.flush()
+        hovered = backend.frame('test')
+        w.update_histogram(self.hsv)
+        scheduler.flush()
+        frame = backend.frame('test')
+        np.testing.assert_array_equal(frame[19:22, 30:70], hovered[19:22, 30:70])
+
+
+class TestViewport(ut.TestCase):
+    img = np.random.default_rng(0).integers(0, 256, (1500, 2500, 3),
+                                            dtype=np.uint8)
+
+    def test_render(self):
+        view = Viewport(self.img, (320, 240))
+        self.assertEqual(view.render().shape, (240, 320, 3))
+        self.assertGreater(view.level, 0)
+        view.zoom, view.origin = 1., (100., 200.)
+        np.testing.assert_array_equal(view.render(), self.img[200:440, 100:420])
+        view.zoom = 4.
+        np.testing.assert_array_equal(view.render()[::4, ::4],
+                                      self.img[200:260, 100:180])
+
+    def test_full_resolution_selection(self):
+        sel = ViewportSelection('test', self.img, (320, 240),
+                                backend=MemoryBackend())
+        sel.viewport.zoom_at(Point(0, 0), 2 / sel.viewport.zoom)  # zoom = 2
+        sel.viewport.pan(-200, -100)
+        sel.refresh()
+        for event, x, y in ((cv2.EVENT_LBUTTONDOWN, 10, 20),
+                            (cv2.EVENT_MOUSEMOVE, 31, 40),
+                            (cv2.EVENT_LBUTTONUP, 31, 40)):
+            sel.on_mouse_event(event, x, y, cv2.EVENT_FLAG_LBUTTON, None)
+        self.assertEqual(sel.selection, Rect(105, 60, 11, 11))
 
 
 class TestTextUtils(ut.TestCase):
@@ -61,6 +466,363 @@ class TestTextUtils(ut.TestCase):
         self.assertEqual(alignment_vector(Align.bottom | Align.right, 16, 16),
                          Vector(-15, -15))
 
+    def test_text_layout_cache(self):
+        text_layouts.clear()
+        text_layouts.reset_stats()
+        images = np.zeros((2, 40, 60, 3), np.uint8)
+        rects = [put_text_block(img, "S.1\nB.22", Vector(59, 39), color=255,
+                                align=Align.bottom | Align.right)
+                 for img in images]
+        self.assertEqual(text_layouts.hits, 1)
+        self.assertEqual(rects[0], rects[1])
+        np.testing.assert_array_equal(images[0], images[1])
+        self.assertTrue(images[0].any())
+
+
+class TestBufferPool(ut.TestCase):
+    def test_ring(self):
+        pool = BufferPool(depth=2)
+        a, b, c = (pool.get('mask', (4, 4)) for _ in range(3))
+        self.assertIsNot(a, b)
+        self.assertIs(a, c)
+        self.assertIsNot(pool.get('hsv', (4, 4)), a)  # rings of names
+        self.assertEqual(pool.get('mask', (4, 4), np.float32).dtype, np.float32)
+        self.assertEqual((pool.requests, pool.allocations), (5, 4))
+        self.assertEqual(pool.nbytes, 16 * 3 + 64)
+
+    def test_frame_masker(self):
+        frames = np.random.default_rng(0).integers(0, 256, (4, 30, 40, 3),
+                                                   dtype=np.uint8)
+        rng = HSVRange((170, 40, 50), (9, 200, 210))
+        masker = FrameMasker(rng)
+        outputs = [masker(frame) for frame in frames[:2]]
+        self.assertEqual(masker.pool.allocations, 6)
+        for frame in frames[2:]:
+            previous = outputs[-1]
+            hsv, mask, masked = masker(frame)
+            self.assertFalse(any(np.shares_memory(a, b)
+                                 for a, b in zip(previous, (hsv, mask, masked))))
+            np.testing.assert_array_equal(hsv, cv2.cvtColor(frame, cv2.COLOR_BGR2HSV))
+            np.testing.assert_array_equal(mask, range_mask(hsv, rng))
+            np.testing.assert_array_equal(masked, cv2.bitwise_and(frame, frame, mask=mask))
+            outputs.append((hsv, mask, masked))
+        self.assertEqual(masker.pool.allocations, 6)  # steady state
+
+
+class TestLRUCache(ut.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(max_bytes=30)
+        for i in range(3):
+            cache.put(i, np.zeros(10, np.uint8))
+        self.assertIsNotNone(cache.get(0))  # 0 becomes recently used
+        cache.put(3, np.zeros(10, np.uint8))
+        self.assertNotIn(1, cache)
+        self.assertIn(0, cache)
+        self.assertEqual(cache.nbytes, 30)
+        self.assertFalse(cache.put(4, np.zeros(31, np.uint8)))
+
+    def test_stats(self):
+        cache = LRUCache(max_bytes=100)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', np.zeros(1))
+        cache.get('a')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+class TestMasking(ut.TestCase):
+    hsv = cv2.cvtColor(np.random.default_rng(0).integers(
+        0, 256, (32, 48, 3), dtype=np.uint8), cv2.COLOR_BGR2HSV)
+
+    def test_range_from_colors(self):
+        rng = HSVRange.from_colors((175, 10, 20), (175, 30, 40), hue_width=10)
+        self.assertEqual(rng, HSVRange((165, 10, 20), (5, 30, 40)))
+        self.assertTrue(rng.wraps)
+        rng = HSVRange.from_colors((0, 0, 0), (0, 255, 255), hue_width=90)
+        self.assertEqual(rng, HSVRange((0, 0, 0), (179, 255, 255)))
+
+    def test_wraparound_mask(self):
+        rng = HSVRange((170, 40, 50), (9, 200, 210))
+        expected = (cv2.inRange(self.hsv, np.uint8((170, 40, 50)), np.uint8((179, 200, 210))) +
+                    cv2.inRange(self.hsv, np.uint8((0, 40, 50)), np.uint8((9, 200, 210))))
+        dst = np.empty(self.hsv.shape[:2], np.uint8)
+        self.assertIs(RangeMask(rng)(self.hsv, dst), dst)
+        np.testing.assert_array_equal(dst, expected)
+        rng = HSVRange((10, 40, 50), (30, 200, 210))
+        np.testing.assert_array_equal(
+            range_mask(self.hsv, rng),
+            cv2.inRange(self.hsv, np.uint8(rng.lower), np.uint8(rng.upper)))
+
+    def test_roi_masker(self):
+        bgr = np.random.default_rng(1).integers(0, 256, (60, 80, 3), dtype=np.uint8)
+        rng = HSVRange((170, 40, 50), (9, 200, 210))
+        full = range_mask(cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV), rng)
+        rects = [Rect(5, 5, 20, 10), (60, 40, 40, 40)]  # second one is clipped
+        expected = np.zeros_like(full)
+        for y, x in ((slice(5, 15), slice(5, 25)), (slice(40, 60), slice(60, 80))):
+            expected[y, x] = full[y, x]
+
+        masker = ROIMasker(rng, rects)
+        dst = np.full_like(full, 7)
+        self.assertIs(masker(bgr, dst), dst)
+        np.testing.assert_array_equal(dst, expected)
+        dst[0, 0] = 7  # outside of regions isn't cleared again
+        masker(bgr, dst)
+        self.assertEqual(dst[0, 0], 7)
+        masker.set_rects(Rect(0, 0, 10, 10))
+        np.testing.assert_array_equal(masker(bgr, dst)[:10, :10], full[:10, :10])
+        self.assertEqual(dst[5:15, 10:25].sum(), 0)
+
+        masker = ROIMasker(rng, rects, output='roi', convert=None)
+        rois = masker(cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV))
+        self.assertEqual([m.shape for m in rois], [(10, 20), (20, 20)])
+        np.testing.assert_array_equal(rois[0], full[5:15, 5:25])
+        np.testing.assert_array_equal(rois[1], full[40:, 60:])
+
+    def test_incremental_masker(self):
+        rng = np.random.default_rng(2)
+        frame = rng.integers(0, 256, (70, 100, 3), dtype=np.uint8)
+        slider = SliderHSV('test', backend=MemoryBackend())
+        slider.set_range(HSVRange((170, 40, 50), (9, 200, 210)))
+        masker = IncrementalMasker(SliderMask(slider), block=16, threshold=4)
+        frames = [frame.copy() for _ in range(4)]
+        frames[1][20:30, 40:45] = rng.integers(0, 256, (10, 5, 3))  # 1 block
+        frames[2] = frames[1].copy()
+        frames[2][60:, 90:] ^= 3  # below threshold, last (partial) block
+        frames[3] = frames[1].copy()
+        for i, f in enumerate(frames):
+            if i == 3:
+                slider.set_range(HSVRange((100, 40, 50), (120, 200, 210)))
+            # changes below threshold keep the previous mask
+            masked = frames[1] if i == 2 else f
+            expected = range_mask(cv2.cvtColor(masked, cv2.COLOR_BGR2HSV),
+                                  HSVRange.from_slider(slider))
+            dst = np.empty(f.shape[:2], np.uint8)
+            self.assertIs(masker(f, dst), dst)
+            np.testing.assert_array_equal(dst, expected)
+            self.assertEqual(masker.last_skipped,
+                             (0, 34 / 35, 1, 0)[i])  # 5x7 blocks
+        self.assertAlmostEqual(masker.skip_fraction, (34 / 35 + 1) / 4)
+
+    def test_tiled_masker(self):
+        bgr = cv2.cvtColor(self.hsv, cv2.COLOR_HSV2BGR)
+        rng = HSVRange((170, 40, 50), (9, 200, 210))
+        expected = range_mask(cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV), rng)
+        masked = np.full_like(bgr, 7)  # stale content must be cleared
+        with TiledMasker(rng, threads=2, strips=5) as tiled:
+            mask, _ = tiled(bgr, masked=masked)
+        np.testing.assert_array_equal(mask, expected)
+        np.testing.assert_array_equal(
+            masked, cv2.bitwise_and(bgr, bgr, mask=expected))
+        with TiledMasker(rng, threads=2, strips=8) as tiled:  # more strips than rows
+            mask, _ = tiled(bgr[:3])
+        np.testing.assert_array_equal(mask, expected[:3])
+
+    def test_suggest_range(self):
+        rng = np.random.default_rng(0)
+        hsv = np.zeros((100, 200, 3), np.uint8)
+        hsv[:, :100] = (90, 10, 10)  # outside of the region
+        hsv[:, 100:, 0] = rng.normal(178, 3, (100, 100)).round() % 180
+        hsv[:, 100:, 1] = rng.integers(100, 201, (100, 100))
+        hsv[:, 100:, 2] = 200
+        suggested = suggest_range(hsv, Rect(100, 0, 100, 100), is_hsv=True)
+        self.assertTrue(suggested.wraps)
+        self.assertAlmostEqual(suggested.lower[1], 105, delta=2)
+        self.assertAlmostEqual(suggested.upper[1], 195, delta=2)
+        self.assertEqual((suggested.lower[2], suggested.upper[2]), (200, 200))
+        covered = range_mask(hsv[:, 100:], HSVRange(
+            (suggested.lower[0], 0, 0), (suggested.upper[0], 255, 255)))
+        self.assertAlmostEqual(np.count_nonzero(covered) / covered.size, 0.9,
+                               delta=0.05)
+        full = suggest_range(hsv, is_hsv=True, percentile=0)
+        self.assertEqual(full.lower[0], 90)  # largest gap is 91-169
+
+        w = SliderHSV('test', backend=MemoryBackend())
+        hue_width = w.set_range(suggested)
+        from_slider = HSVRange.from_slider(w, hue_width)
+        self.assertEqual(w.hue, (suggested.lower[0] + hue_width) % 180)
+        self.assertEqual((from_slider.lower[0], from_slider.upper[0]),
+                         (suggested.lower[0], suggested.upper[0]))
+        for i in (1, 2):  # selection can only be wider due to rounding
+            self.assertLessEqual(from_slider.lower[i], suggested.lower[i])
+            self.assertGreaterEqual(from_slider.upper[i], suggested.upper[i])
+
+    def test_classifier(self):
+        rngs = [HSVRange((20 * i, 0, 50), ((20 * i + 30) % 180, 255, 255))
+                for i in range(10)] + [HSVRange((170, 0, 0), (10, 255, 255))]
+        classifier = ColorClassifier({f"c{i}": rng for i, rng in enumerate(rngs)})
+        expected = np.zeros(self.hsv.shape[:2], np.uint8)
+        for i, rng in reversed(list(enumerate(rngs))):  # first class wins
+            expected[range_mask(self.hsv, rng) > 0] = i + 1
+        np.testing.assert_array_equal(classifier.labels(self.hsv), expected)
+        counts = classifier.counts(self.hsv)
+        self.assertEqual(counts['c10'], np.count_nonzero(expected == 11))
+        self.assertEqual(sum(counts.values()), np.count_nonzero(expected))
+
+
+class TestRangeSnapshot(ut.TestCase):
+    def test_version(self):
+        w = SliderHSV('test', size=128, backend=MemoryBackend())
+        version = w.version
+        w.set_value(30)
+        self.assertEqual(w.version, version + 1)
+        w.sel.set_selection(Rect(10, 20, 30, 40))
+        snapshot = w.snapshot
+        self.assertEqual(snapshot.version, version + 2)
+        w.set_value(30)
+        w.sel.set_selection(Rect(10, 20, 30, 40))
+        self.assertIs(w.snapshot, snapshot)  # same range, no new version
+        self.assertEqual(snapshot.lower_color, (30, 40, 20))
+        self.assertEqual(snapshot.range(5), HSVRange.from_slider(w, 5))
+
+        mask = SliderMask(w, hue_width=5)
+        hsv = np.random.default_rng(0).integers(0, 256, (60, 80, 3), dtype=np.uint8)
+        for _ in range(3):
+            np.testing.assert_array_equal(mask(hsv), range_mask(hsv, snapshot.range(5)))
+        self.assertEqual(mask.rebuilds, 1)
+        mask.hue_width = 10
+        w.set_value(40)
+        np.testing.assert_array_equal(mask(hsv), range_mask(hsv, w.snapshot.range(10)))
+        self.assertEqual(mask.rebuilds, 2)
+
+    def test_no_torn_ranges(self):
+        import threading
+        w = SliderHSV('test', size=128, backend=MemoryBackend(),
+                      scheduler=RenderScheduler())  # no rendering
+        ranges = [HSVRange((10, 0, 0), (20, 255, 255)),
+                  HSVRange((100, 128, 128), (110, 200, 200))]
+        widths = [w.set_range(rng) for rng in ranges]
+        expected = {HSVRange.from_slider(w, widths[1])}
+        w.set_range(ranges[0])
+        expected.add(HSVRange.from_slider(w, widths[0]))
+        done = threading.Event()
+
+        def writer():
+            for i in range(500):
+                w.set_range(ranges[i % 2])
+            done.set()
+        thread = threading.Thread(target=writer)
+        thread.start()
+        while not done.is_set():
+            snapshot = w.snapshot
+            rng = snapshot.range(widths[snapshot.lower_color[0] > 50])
+            self.assertIn(rng, expected)
+        thread.join()
+
+
+class TestFrameSources(ut.TestCase):
+    @staticmethod
+    def fill(i, buf):
+        buf[:] = i
+
+    def test_all(self):
+        with SyntheticSource(self.fill, (4, 4, 3), count=20, buffers=2) as source:
+            frames = [(source.index, frame[0, 0, 0]) for frame in source]
+        self.assertEqual(frames, [(i, i) for i in range(20)])
+        self.assertEqual((source.decoded, source.dropped), (20, 0))
+        self.assertEqual(len({id(buf) for buf in source.buffers}), 2)
+
+    def test_latest(self):
+        import time
+        with SyntheticSource(self.fill, (4, 4, 3), count=200, policy='latest') as source:
+            indices = []
+            for frame in source:
+                self.assertEqual(frame[0, 0, 0], source.index % 256)
+                indices.append(source.index)
+                time.sleep(0.001)  # consumer is slower than decoding
+        self.assertEqual(indices, sorted(set(indices)))
+        self.assertEqual(indices[-1], 199)  # the newest frame is never dropped
+        self.assertEqual(source.dropped, 200 - len(indices))
+        self.assertGreater(source.dropped, 0)
+
+    def test_files(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        paths = [os.path.join(tmp.name, f"{i}.png") for i in range(3)]
+        for i, path in enumerate(paths):
+            cv2.imwrite(path, np.full((30 + i, 40, 3), i * 50, np.uint8))
+        with ImageSequence(paths) as source:
+            frames = [frame.copy() for frame in source]
+        self.assertEqual([f.shape for f in frames], [(30, 40, 3)] * 3)
+        self.assertEqual([f[0, 0, 0] for f in frames], [0, 50, 100])
+
+        path = os.path.join(tmp.name, 'video.avi')
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (40, 30))
+        for i in range(5):
+            writer.write(np.full((30, 40, 3), i * 50, np.uint8))
+        writer.release()
+        with VideoSource(path) as source:
+            self.assertEqual(source.shape, (30, 40, 3))
+            values = [int(frame.mean()) for frame in source]
+        self.assertEqual(len(values), 5)
+        self.assertLess(values[0], 5)  # first frame isn't skipped
+        with self.assertRaises(TypeError):
+            FrameSource((4, 4, 3))  # `read_into` is abstract
+        self.assertEqual(values, sorted(values))
+
+    def test_error(self):
+        def fail(i, buf):
+            raise RuntimeError("camera is gone")
+        source = SyntheticSource(fail, (4, 4, 3))
+        with self.assertRaises(RuntimeError):
+            source.read(timeout=5)
+        source.close()
+        with self.assertRaises(ValueError):
+            SyntheticSource(self.fill, (4, 4, 3), policy='newest')
+
+
+class TestBatch(ut.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.state = os.path.join(self.tmp.name, 'state.json')
+        w = SliderHSV('test', backend=MemoryBackend())
+        self.rng = HSVRange((170, 50, 50), (10, 255, 255))
+        w.set_range(self.rng)
+        w.save_state(self.state, hue_width=10)
+
+    def test_load_state(self):
+        self.assertEqual(batch.load_state(self.state), self.rng)
+
+    def test_ordered_map(self):
+        from concurrent.futures import ThreadPoolExecutor
+        consumed = []
+        args = (consumed.append(i) or i for i in range(20))
+        with ThreadPoolExecutor(4) as executor:
+            for i, ret in enumerate(batch.ordered_map(executor, lambda x: x * 2,
+                                                      args, in_flight=3)):
+                self.assertEqual(ret, i * 2)
+                self.assertLessEqual(len(consumed), i + 4)
+            with self.assertRaises(ValueError):
+                batch.ordered_map(executor, abs, [], in_flight=0)
+
+    def test_directory(self):
+        src, dst = (os.path.join(self.tmp.name, d) for d in ('in', 'out'))
+        os.mkdir(src)
+        images = np.random.default_rng(0).integers(0, 256, (5, 60, 80, 3),
+                                                   dtype=np.uint8)
+        for i, img in enumerate(images):
+            cv2.imwrite(os.path.join(src, f"{i}.png"), img)
+        self.assertEqual(batch.main([self.state, src, dst, '--workers', '2']), 0)
+        for i, img in enumerate(images):
+            mask = cv2.imread(os.path.join(dst, f"{i}.png"), cv2.IMREAD_GRAYSCALE)
+            np.testing.assert_array_equal(
+                mask, range_mask(cv2.cvtColor(img, cv2.COLOR_BGR2HSV), self.rng))
+
+    def test_video(self):
+        src, dst = (os.path.join(self.tmp.name, f) for f in ('in.avi', 'out.avi'))
+        writer = cv2.VideoWriter(src, cv2.VideoWriter_fourcc(*'MJPG'), 10,
+                                 (80, 60))
+        for v in range(0, 250, 25):  # red frames get brighter
+            writer.write(np.full((60, 80, 3), (0, 0, v), np.uint8))
+        writer.release()
+        self.assertEqual(batch.main([self.state, src, dst, '--workers', '2',
+                                     '--in-flight', '3']), 0)
+        capture = cv2.VideoCapture(dst)
+        means = [frame.mean() for frame in batch.video_frames(capture)]
+        self.assertEqual(len(means), 10)
+        self.assertEqual(means[:2], [0, 0])  # below brightness 50
+        self.assertGreater(min(means[3:]), 200)
+
 
 if __name__ == '__main__':
     ut.main()